@@ -0,0 +1,98 @@
+"""
+Benchmark of the event CSV timestamp conversion in events_transcode/remove_dates_from_evt_files.py
+on a synthetic event file ('M/D/YYYY h:mm:ss AM/PM, duration, event' lines).
+
+Compares per line:
+  strptime  : datetime.strptime/strftime, the previous implementation
+  parser    : parse_stages_time, the hand-written parser, without the cache
+  converter : convert_timestamp as used by remove_dates_from_evt_file (parser + lru_cache)
+and times remove_dates_from_evt_file on the whole file.
+
+    python benchmarks/bench_evt_timestamps.py --lines 10000000
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'events_transcode'))
+from remove_dates_from_evt_files import (  # noqa: E402
+    convert_timestamp,
+    parse_stages_time,
+    remove_dates_from_evt_file,
+)
+
+EVENTS = ['Wake', 'Stage1', 'Stage2', 'Stage3', 'REM', 'Central Apnea', 'Arousal', 'Custom User Event 4']
+
+
+def strptime_timestamp(timestamp):
+    try:
+        timestamp_object = datetime.datetime.strptime(timestamp, '%m/%d/%Y %I:%M:%S %p')
+    except ValueError:
+        return None
+    return timestamp_object.strftime('%H:%M:%S')
+
+
+def format_stages_timestamp(t):
+    return f'{t.month}/{t.day}/{t.year} {t.hour % 12 or 12}:{t.minute:02d}:{t.second:02d} {"AM" if t.hour < 12 else "PM"}'
+
+
+def write_event_file(filename, num_lines, seed=0):
+    """
+    Nights of 8 hours with one line per second on average, several events at the same second.
+    """
+    rng = random.Random(seed)
+    t = datetime.datetime(2018, 5, 22, 20, 16, 0)
+    with open(filename, 'w') as f:
+        f.write('Start Time,Duration (seconds),Event\n')
+        for i in range(num_lines - 1):
+            if i % 28800 == 0:
+                t += datetime.timedelta(hours=16)
+            t += datetime.timedelta(seconds=rng.choice([0, 0, 1, 2]))
+            f.write(f'{format_stages_timestamp(t)}, {rng.choice([0, 30]):.3f}, {rng.choice(EVENTS)}\n')
+
+
+def time_per_line(convert, timestamps):
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        convert(timestamp)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'events.csv')
+        write_event_file(filename, args.lines)
+        with open(filename) as f:
+            timestamps = [line.partition(',')[0] for line in f]
+
+        assert all(parse_stages_time(t) == strptime_timestamp(t) for t in timestamps[:100000])
+
+        results = {
+            'strptime': time_per_line(strptime_timestamp, timestamps),
+            'parser': time_per_line(parse_stages_time, timestamps),
+        }
+        convert_timestamp.cache_clear()
+        results['converter'] = time_per_line(convert_timestamp, timestamps)
+
+        convert_timestamp.cache_clear()
+        start = time.perf_counter()
+        remove_dates_from_evt_file(filename)
+        results['remove_dates_from_evt_file'] = time.perf_counter() - start
+
+    print(f'{args.lines} lines')
+    for name, elapsed in results.items():
+        print(f'  {name:28s}: {elapsed:8.2f} s  ({args.lines / elapsed / 1e6:6.2f} M lines/s, '
+              f'{results["strptime"] / elapsed:5.1f}x strptime)')
+
+
+if __name__ == '__main__':
+    main()
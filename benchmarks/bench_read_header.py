@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of sherlock/edf_headers/edf_reader.read_header_edf against the previous
+implementation, which issued one f.read per field per channel and ran every text field
+through charset_normalizer.
+
+    python benchmarks/bench_read_header.py --files 200 --channels 32
+"""
+import argparse
+import datetime
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from charset_normalizer import from_bytes as fm
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'sherlock' / 'edf_headers'))
+from edf_reader import read_header_edf  # noqa: E402
+from synthetic_edf import write_corpus  # noqa: E402
+
+
+def reference_decode_str(b):
+    return str(fm(b).best()).strip()
+
+
+def reference_read_header_edf(edf_filename):
+    # Previous edf_reader.read_header_edf, unchanged
+    with open(edf_filename, "rb") as f:
+        h = {}
+        assert f.tell() == 0
+        assert f.read(8) == b'0       '
+
+        h['local_subject_id'] = reference_decode_str(f.read(80))
+        h['local_recording_id'] = reference_decode_str(f.read(80))
+
+        (day, month, year) = [int(x) for x in re.findall(r'(\d+)', str(f.read(8)))]
+        (hour, minute, sec) = [int(x) for x in re.findall(r'(\d+)', str(f.read(8)))]
+        h['date_time'] = str(datetime.datetime(year + 2000, month, day,
+                                               hour, minute, sec))
+
+        header_nbytes = int(f.read(8))
+        subtype = f.read(44)[:5]
+        h['EDF+'] = 1 if subtype in ['EDF+C', 'EDF+D'] else 0
+        h['contiguous'] = subtype != 'EDF+D'
+        h['n_records'] = int(f.read(8))
+        h['record_length'] = float(f.read(8))
+        nchannels = h['n_channels'] = int(f.read(4))
+
+        channels = list(range(h['n_channels']))
+        h['channels'] = [reference_decode_str(f.read(16)) for n in channels]
+        h['transducer_type'] = [reference_decode_str(f.read(80)) for n in channels]
+        h['units'] = [reference_decode_str(f.read(8)) for n in channels]
+        h['physical_min'] = np.asarray([float(f.read(8)) for n in channels])
+        h['physical_max'] = np.asarray([float(f.read(8)) for n in channels])
+        h['digital_min'] = np.asarray([float(f.read(8)) for n in channels])
+        h['digital_max'] = np.asarray([float(f.read(8)) for n in channels])
+        h['prefiltering'] = [reference_decode_str(f.read(80)) for n in channels]
+        h['n_samples_per_record'] = [int(f.read(8)) for n in channels]
+        f.read(32 * nchannels)
+
+        assert f.tell() == header_nbytes
+        return h
+
+
+def assert_same_header(a, b):
+    assert a.keys() == b.keys(), (a.keys(), b.keys())
+    for key in a:
+        if isinstance(a[key], np.ndarray):
+            assert np.array_equal(a[key], b[key]), key
+        else:
+            assert a[key] == b[key], key
+
+
+def time_reader(reader, edf_files, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for edf_file in edf_files:
+            reader(edf_file)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        edf_files = write_corpus(tmpdir, args.files, n_channels=args.channels, duration=60)
+        for edf_file in edf_files[:10]:
+            assert_same_header(read_header_edf(edf_file), reference_read_header_edf(edf_file))
+
+        t_ref = time_reader(reference_read_header_edf, edf_files, args.repeat)
+        t_new = time_reader(read_header_edf, edf_files, args.repeat)
+
+    print(f'{args.files} files x {args.channels} channels (best of {args.repeat})')
+    print(f'  reference : {t_ref:8.3f} s  ({1e3 * t_ref / args.files:.3f} ms/file)')
+    print(f'  current   : {t_new:8.3f} s  ({1e3 * t_new / args.files:.3f} ms/file)')
+    print(f'  speedup   : {t_ref / t_new:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark of the chunked resampling of edf_normalize on a typical PSG: an 8 hour recording
+at 512 Hz resampled to 128 Hz, against resampling each whole channel in memory.
+
+    python benchmarks/bench_resample.py --hours 8 --channels 6
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from scipy.signal import resample_poly
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'edf_normalize'))
+from edf_normalize import normalize_edf  # noqa: E402
+from edf_mmap import EdfMmap  # noqa: E402
+from synthetic_edf import write_edf  # noqa: E402
+
+
+def resample_whole(edf_file, up, down):
+    # Every channel read into memory and resampled in one call
+    with EdfMmap(edf_file) as edf:
+        return [resample_poly(np.asarray(edf.digital(i), dtype=float), up, down)
+                for i in range(len(edf.channels))]
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type=float, default=8)
+    parser.add_argument('--channels', type=int, default=6)
+    parser.add_argument('--fs-in', type=int, default=512)
+    parser.add_argument('--fs-out', type=int, default=128)
+    args = parser.parse_args()
+
+    labels = [f'EEG {i}' for i in range(args.channels)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = Path(tmpdir) / 'psg.edf'
+        dest = Path(tmpdir) / 'out' / 'psg.edf'
+        dest.parent.mkdir()
+        write_edf(src, n_channels=args.channels, sample_rate=args.fs_in, duration=int(args.hours * 3600),
+                  labels=labels, random_data=True)
+        montage = {label: [label] for label in labels}
+
+        whole, t_whole, mem_whole = measure(lambda: resample_whole(src, args.fs_out, args.fs_in))
+        _, t_chunked, mem_chunked = measure(lambda: normalize_edf(src, dest, montage, labels, args.fs_out))
+
+        with EdfMmap(dest) as edf:
+            max_diff = max(np.abs(edf.digital(i) - np.rint(whole[i])).max() for i in range(args.channels))
+
+    print(json.dumps({
+        'hours': args.hours,
+        'channels': args.channels,
+        'fs_in': args.fs_in,
+        'fs_out': args.fs_out,
+        'whole_s': round(t_whole, 3),
+        'whole_peak_mb': round(mem_whole / 2 ** 20, 1),
+        'chunked_s': round(t_chunked, 3),
+        'chunked_peak_mb': round(mem_chunked / 2 ** 20, 1),
+        'max_digital_diff': int(max_diff),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Startup time of the tools: what a job array task or a spawned worker process pays
+before any work starts.
+
+For each tool, `python -X importtime -c "import <module>"` is run in a fresh process
+(from the tool's folder, as the tools import their neighbours) and the cumulative import
+time of the module is read from the report, along with the heavy libraries it loaded.
+The wall time of `python <tool> --help` is timed as well. The best of `--repeat` runs
+is kept.
+
+    python benchmarks/bench_startup.py --output startup.json
+    python benchmarks/bench_startup.py --compare startup.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+# (name, folder, module, arguments of the --help run)
+TOOLS = [
+    ('run.py', 'sherlock/edf_headers', 'run', ['--help']),
+    ('edf_reader', 'sherlock/edf_headers', 'edf_reader', None),
+    ('channel_label_identifier', '.', 'channel_label_identifier', ['--help']),
+    ('edf_verify', 'edf_verify', 'edf_verify', ['--help']),
+    ('edf_normalize', 'edf_normalize', 'edf_normalize', ['--help']),
+    ('deidentify_edf', 'edf_deidentify', 'deidentify_edf', ['--help']),
+    ('edf_annotations_to_csv', 'events_transcode', 'edf_annotations_to_csv', ['--help']),
+]
+
+# Libraries that only some code paths need
+HEAVY_MODULES = ['mne', 'pyedflib', 'scipy', 'pandas', 'pyarrow', 'tqdm', 'charset_normalizer', 'matplotlib']
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def parse_importtime(stderr):
+    """
+    {module: cumulative microseconds} of the `-X importtime` report.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is not None:
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def time_import(folder, module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=REPO / folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise Exception(result.stderr.strip().splitlines()[-1])
+    modules = parse_importtime(result.stderr)
+    return modules.get(module, 0) / 1e6, [m for m in HEAVY_MODULES if m in modules]
+
+
+def time_help(folder, module, args, workdir):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(REPO / folder / f'{module}.py')] + args,
+                   cwd=workdir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = {r['tool']: r for r in json.load(f)['results']}
+
+    print(f'\nCompared to {baseline_file} (import time ratio, < 1 is faster):')
+    for r in results:
+        old = baseline.get(r['tool'])
+        if old is not None and 'import_s' in old and 'import_s' in r:
+            print(f'  {r["tool"]:26s}{old["import_s"] * 1e3:9.1f} ms -> {r["import_s"] * 1e3:9.1f} ms'
+                  f'  {r["import_s"] / max(old["import_s"], 1e-9):6.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tools', nargs='+', choices=[t[0] for t in TOOLS], default=[t[0] for t in TOOLS])
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per tool, the best is kept')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"tool":26s}{"import ms":>10}{"--help ms":>10}  heavy modules')
+    # --help runs from an empty directory: run.py must not need a config.json to start
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, folder, module, help_args in TOOLS:
+            if name not in args.tools:
+                continue
+            try:
+                import_s = min(time_import(folder, module)[0] for _ in range(args.repeat))
+                heavy = time_import(folder, module)[1]
+            except Exception as e:
+                results.append({'tool': name, 'error': str(e)})
+                print(f'{name:26s} FAIL | {e}')
+                continue
+            help_s = min(time_help(folder, module, help_args, workdir) for _ in range(args.repeat)) \
+                if help_args is not None else None
+            results.append({'tool': name, 'import_s': import_s, 'help_s': help_s, 'heavy_modules': heavy})
+            print(f'{name:26s}{import_s * 1e3:10.1f}' + (f'{help_s * 1e3:10.1f}' if help_s is not None else f'{"":>10}') +
+                  f'  {", ".join(heavy) or "-"}')
+
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Benchmark suite of the EDF utilities on synthetic corpora of several sizes.
+
+For each corpus size, a corpus of two cohorts is written with synthetic_edf.write_corpus
+(a share of EDF+ files with annotations and of corrupted headers), along with one event
+CSV per EDF file. Then each of these is timed:
+
+  read_header_edf       sherlock/edf_headers/edf_reader.read_header_edf on every file
+  channel_labels        channel_label_identifier.getChannelLabels (iterChannelLabels, --jobs threads)
+  verify_edf_files      edf_verify.verify_edf_files (--jobs processes)
+  run_py                sherlock/edf_headers/run.py in a subprocess (--jobs workers)
+  remove_dates          events_transcode remove_dates_from_evt_files (--jobs processes)
+
+The header cache is disabled, so every benchmark reads the files. Results are written
+as JSON; give an earlier results file with --compare to print the ratio per benchmark.
+
+    python benchmarks/run_suite.py --sizes 100 10000 100000 --output results.json
+    python benchmarks/run_suite.py --sizes 100 --compare results.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / 'sherlock' / 'edf_headers'))
+sys.path.insert(0, str(REPO / 'edf_verify'))
+sys.path.insert(0, str(REPO / 'events_transcode'))
+sys.path.insert(0, str(REPO))
+
+# Every benchmark reads the files, not the shared header cache
+os.environ['EDF_HEADER_CACHE'] = ''
+
+from bench_evt_timestamps import write_event_file  # noqa: E402
+from channel_label_identifier import iterChannelLabels  # noqa: E402
+from edf_reader import read_header_edf  # noqa: E402
+from edf_verify import verify_edf_files  # noqa: E402
+from remove_dates_from_evt_files import convert_timestamp, remove_dates_from_evt_files  # noqa: E402
+from synthetic_edf import write_corpus  # noqa: E402
+
+BENCHMARKS = ['read_header_edf', 'channel_labels', 'verify_edf_files', 'run_py', 'remove_dates']
+DEFAULT_SIZES = [100, 10000, 100000]
+COHORTS = ['AAA_Synthetic', 'BBB_Synthetic']
+
+
+@contextlib.contextmanager
+def quiet():
+    # The tools print one or more lines per file, and pyedflib writes to the file descriptors directly
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            yield
+    finally:
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+
+
+def write_suite_corpus(root, n_files, args):
+    """
+    Cohorts laid out as run.py expects (<root>/psg/<cohort>/all/*.edf) and event CSVs in <root>/evt.
+    """
+    edf_files = []
+    per_cohort = [n_files // len(COHORTS) + (i < n_files % len(COHORTS)) for i in range(len(COHORTS))]
+    for cohort, n in zip(COHORTS, per_cohort):
+        edf_files += write_corpus(os.path.join(root, 'psg', cohort, 'all'), n,
+                                  edf_plus_every=args.edf_plus_every, corrupt_every=args.corrupt_every,
+                                  n_channels=args.channels, sample_rate=args.sample_rate, duration=args.duration)
+
+    evt_path = os.path.join(root, 'evt')
+    os.makedirs(evt_path, exist_ok=True)
+    for i in range(n_files):
+        write_event_file(os.path.join(evt_path, f'synthetic_{i:06d}.csv'), args.evt_lines, seed=i)
+    return edf_files
+
+
+def bench_read_header_edf(root, edf_files, args):
+    for edf_file in edf_files:
+        try:
+            read_header_edf(edf_file)
+        except Exception:
+            pass
+
+
+def bench_channel_labels(root, edf_files, args):
+    with quiet():
+        for _ in iterChannelLabels(edf_files, cache=None, jobs=args.jobs):
+            pass
+
+
+def bench_verify_edf_files(root, edf_files, args):
+    with quiet():
+        verify_edf_files(os.path.join(root, 'psg'), jobs=args.jobs, recursive=True)
+
+
+def bench_run_py(root, edf_files, args):
+    config = {
+        'COHORTS_PATH': os.path.join(root, 'psg'),
+        'COHORTS': COHORTS,
+        'EDF_PATH': '<COHORT_PATH>/<COHORT>/all',
+        'HEADER_CSV_COLUMNS': ['file_stem', 'extension', 'cohort', 'start_date', 'start_time',
+                               'duration_hours', 'edf_compliant', 'edf_plus', 'file_size_mb'],
+        'FAILED_CSV_COLUMNS': ['file_stem', 'extension', 'cohort', 'error'],
+        'OUTPATH': os.path.join(root, 'out'),
+        'HEADER_CSV_FNAME': 'oak_psg_dictionary.csv',
+        'FAILED_CSV_FNAME': 'oak_psg_failed.csv',
+        'INDEX_COL': 'file_stem',
+        'ARCHIVE_PATH': os.path.join(root, 'archives'),
+        'VERSION': '0',
+    }
+    workdir = os.path.join(root, 'run_py')
+    for path in [workdir, config['OUTPATH'], config['ARCHIVE_PATH']]:
+        os.makedirs(path, exist_ok=True)
+    for fname in [config['HEADER_CSV_FNAME'], config['FAILED_CSV_FNAME']]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(config['OUTPATH'], fname))
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    subprocess.run([sys.executable, str(REPO / 'sherlock' / 'edf_headers' / 'run.py'),
+                    '--no-cache', '--workers', str(args.jobs)],
+                   cwd=workdir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench_remove_dates(root, edf_files, args):
+    convert_timestamp.cache_clear()
+    with quiet():
+        remove_dates_from_evt_files(pathname=os.path.join(root, 'evt'), workers=args.jobs)
+
+
+def run_benchmark(name, root, edf_files, args):
+    bench = globals()['bench_' + name]
+    best = float('inf')
+    for _ in range(args.repeat):
+        if name == 'remove_dates':
+            # Files are rewritten in place: convert fresh copies every time
+            for i in range(len(edf_files)):
+                write_event_file(os.path.join(root, 'evt', f'synthetic_{i:06d}.csv'), args.evt_lines, seed=i)
+        start = time.perf_counter()
+        bench(root, edf_files, args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = {(r['benchmark'], r['files']): r for r in json.load(f)['results']}
+
+    print(f'\nCompared to {baseline_file} (time ratio, < 1 is faster):')
+    for r in results:
+        old = baseline.get((r['benchmark'], r['files']))
+        if old is not None:
+            print(f'  {r["benchmark"]:18s}{r["files"]:>8}  {old["seconds"]:9.3f} s -> {r["seconds"]:9.3f} s'
+                  f'  {r["seconds"] / old["seconds"]:6.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of EDF files per corpus')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--sample-rate', type=int, default=256)
+    parser.add_argument('--duration', type=int, default=60, help='Seconds of signal per file (sparse files)')
+    parser.add_argument('--edf-plus-every', type=int, default=10, help='Every n-th file is EDF+ with annotations')
+    parser.add_argument('--corrupt-every', type=int, default=50, help='Every n-th file has a corrupted header')
+    parser.add_argument('--evt-lines', type=int, default=200, help='Lines per event CSV')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Threads/processes of the parallel tools')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per benchmark, the best is kept')
+    parser.add_argument('--workdir', help='Directory for the corpora (default: a temporary directory)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmpdir:
+        for n_files in args.sizes:
+            root = os.path.join(tmpdir, f'corpus_{n_files}')
+            start = time.perf_counter()
+            edf_files = write_suite_corpus(root, n_files, args)
+            print(f'{n_files} files: corpus written in {time.perf_counter() - start:.1f} s')
+
+            for name in args.benchmarks:
+                seconds = run_benchmark(name, root, edf_files, args)
+                results.append({
+                    'benchmark': name,
+                    'files': n_files,
+                    'seconds': seconds,
+                    'files_per_s': n_files / seconds,
+                })
+                print(f'  {name:18s}{seconds:9.3f} s  {n_files / seconds:10.1f} files/s')
+
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
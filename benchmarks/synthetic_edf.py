@@ -0,0 +1,189 @@
+"""
+Synthetic EDF files for the benchmarks.
+
+Files are written byte by byte from the EDF specification, so no EDF library is needed
+to generate a corpus. Besides plain EDF files, `write_edf` can write EDF+C files with an
+'EDF Annotations' channel and files with one of the header defects of CORRUPTIONS.
+"""
+import datetime
+import os
+
+import numpy as np
+
+
+ANNOTATION_LABEL = 'EDF Annotations'
+
+# Header defects `write_edf(..., corrupt=...)` can introduce
+CORRUPTIONS = [
+    'truncated',        # last data records missing
+    'n_records',        # header claims more data records than the file has
+    'header_nbytes',    # wrong number of header bytes
+    'version',          # version field is not '0'
+    'n_channels',       # number of signals is not a number
+    'digital_range',    # digital minimum above digital maximum
+]
+
+
+def edf_field(value, width):
+    return str(value).ljust(width)[:width].encode('latin-1')
+
+
+def edf_number(value, width):
+    s = str(value)
+    if len(s) > width and isinstance(value, float):
+        s = f'{value:.{max(width - 2, 0)}g}'
+    return edf_field(s, width)
+
+
+def format_tal(onset, duration=None, texts=('',)):
+    """
+    Time-stamped annotation list: '+onset[\\x15duration]\\x14text\\x14...\\x00'.
+    """
+    tal = f'{onset:+g}'
+    if duration is not None:
+        tal += f'\x15{duration:g}'
+    return (tal + '\x14' + ''.join(t + '\x14' for t in texts) + '\x00').encode('utf-8')
+
+
+def annotation_records(annotations, n_records, record_length, nbytes):
+    """
+    Bytes of the annotation signal of each data record: the time-keeping TAL followed by
+    the annotations whose onset falls in the record (as many as fit in `nbytes`).
+    """
+    by_record = {}
+    for onset, duration, text in sorted(annotations):
+        by_record.setdefault(int(onset // record_length), []).append(format_tal(onset, duration, [text]))
+
+    records = []
+    for i in range(n_records):
+        record = format_tal(i * record_length)
+        for tal in by_record.get(i, []):
+            if len(record) + len(tal) <= nbytes:
+                record += tal
+        records.append(record.ljust(nbytes, b'\x00'))
+    return records
+
+
+def write_edf(path, n_channels=20, sample_rate=256, duration=3600, record_length=1,
+              labels=None, patient_id='X X X X', recording_id='Startdate X X X X',
+              start=datetime.datetime(2018, 5, 22, 20, 16, 0), random_data=False, seed=0,
+              annotations=None, annotation_samples=60, corrupt=None):
+    """
+    Write an EDF file with `n_channels` signals of `duration` seconds.
+
+    `sample_rate` is one rate for all channels or a list with one rate per channel.
+    With `annotations`, a list of (onset, duration, text), the file is EDF+C with an extra
+    'EDF Annotations' signal of `annotation_samples` samples per record. `corrupt` is one
+    of CORRUPTIONS.
+
+    Signal data is zeros (a sparse file for plain EDF) unless `random_data` is set.
+    """
+    if labels is None:
+        labels = [f'EEG {i}' for i in range(n_channels)]
+    sample_rates = sample_rate if isinstance(sample_rate, (list, tuple)) else [sample_rate] * n_channels
+    n_records = int(duration // record_length)
+    n_samples = [int(fs * record_length) for fs in sample_rates]
+
+    edf_plus = annotations is not None
+    labels = list(labels)
+    signal_fields = {
+        'transducer': ['AgAgCl electrode'] * n_channels,
+        'units': ['uV'] * n_channels,
+        'physical_min': [-500] * n_channels,
+        'physical_max': [500] * n_channels,
+        'digital_min': [-32768] * n_channels,
+        'digital_max': [32767] * n_channels,
+        'prefiltering': ['HP:0.3Hz LP:35Hz'] * n_channels,
+    }
+    if edf_plus:
+        labels.append(ANNOTATION_LABEL)
+        n_samples.append(annotation_samples)
+        for key, value in [('transducer', ''), ('units', ''), ('physical_min', -1), ('physical_max', 1),
+                           ('digital_min', -32768), ('digital_max', 32767), ('prefiltering', '')]:
+            signal_fields[key].append(value)
+    if corrupt == 'digital_range':
+        signal_fields['digital_min'][0], signal_fields['digital_max'][0] = 32767, -32768
+
+    n_signals = len(labels)
+    header_nbytes = 256 * (n_signals + 1)
+    fixed = b''.join([
+        edf_field('0' if corrupt != 'version' else 'EDF', 8),
+        edf_field(patient_id, 80),
+        edf_field(recording_id, 80),
+        edf_field(start.strftime('%d.%m.%y'), 8),
+        edf_field(start.strftime('%H.%M.%S'), 8),
+        edf_number(header_nbytes if corrupt != 'header_nbytes' else header_nbytes + 256, 8),
+        edf_field('EDF+C' if edf_plus else '', 44),
+        edf_number(n_records if corrupt != 'n_records' else n_records + 10, 8),
+        edf_number(record_length, 8),
+        edf_number(n_signals, 4) if corrupt != 'n_channels' else edf_field('xx', 4),
+    ])
+    signal = b''.join([
+        b''.join(edf_field(l, 16) for l in labels),
+        b''.join(edf_field(v, 80) for v in signal_fields['transducer']),
+        b''.join(edf_field(v, 8) for v in signal_fields['units']),
+        b''.join(edf_number(v, 8) for v in signal_fields['physical_min']),
+        b''.join(edf_number(v, 8) for v in signal_fields['physical_max']),
+        b''.join(edf_number(v, 8) for v in signal_fields['digital_min']),
+        b''.join(edf_number(v, 8) for v in signal_fields['digital_max']),
+        b''.join(edf_field(v, 80) for v in signal_fields['prefiltering']),
+        b''.join(edf_number(n, 8) for n in n_samples),
+        edf_field('', 32) * n_signals,
+    ])
+
+    n_signal_samples = sum(n_samples[:n_channels])
+    record_nbytes = 2 * sum(n_samples)
+    n_written = n_records - 2 if corrupt == 'truncated' else n_records
+
+    with open(path, 'wb') as f:
+        f.write(fixed + signal)
+        if edf_plus or random_data:
+            rng = np.random.default_rng(seed)
+            tals = annotation_records(annotations, n_records, record_length, 2 * annotation_samples) \
+                if edf_plus else None
+            zeros = bytes(2 * n_signal_samples)
+            for i in range(n_written):
+                if random_data:
+                    f.write(rng.integers(-3000, 3000, n_signal_samples, dtype='<i2').tobytes())
+                else:
+                    f.write(zeros)
+                if edf_plus:
+                    f.write(tals[i])
+        else:
+            f.truncate(header_nbytes + n_written * record_nbytes)
+        if corrupt == 'truncated':
+            f.write(bytes(record_nbytes // 2))
+
+    return path
+
+
+def sleep_stage_annotations(duration, epoch=30, seed=0):
+    """
+    One sleep stage annotation per epoch and a few arousals, as (onset, duration, text).
+    """
+    rng = np.random.default_rng(seed)
+    stages = ['Sleep stage W', 'Sleep stage N1', 'Sleep stage N2', 'Sleep stage N3', 'Sleep stage R']
+    annotations = [(float(t), float(epoch), stages[rng.integers(len(stages))]) for t in range(0, int(duration), epoch)]
+    annotations += [(float(t) + 0.5, 3.0, 'Arousal') for t in range(epoch // 2, int(duration), 10 * epoch)]
+    return annotations
+
+
+def write_corpus(dirname, n_files, edf_plus_every=0, corrupt_every=0, **kwargs):
+    """
+    Write `n_files` EDF files to `dirname`. Every `edf_plus_every`-th file is EDF+ with sleep
+    stage annotations and every `corrupt_every`-th file has one of CORRUPTIONS (in turn);
+    0 means none.
+    """
+    os.makedirs(dirname, exist_ok=True)
+    duration = kwargs.get('duration', 3600)
+    annotations = sleep_stage_annotations(duration) if edf_plus_every > 0 else None
+
+    edf_files = []
+    for i in range(n_files):
+        file_kwargs = dict(kwargs)
+        if edf_plus_every > 0 and i % edf_plus_every == edf_plus_every - 1:
+            file_kwargs['annotations'] = annotations
+        if corrupt_every > 0 and i % corrupt_every == corrupt_every - 1:
+            file_kwargs['corrupt'] = CORRUPTIONS[(i // corrupt_every) % len(CORRUPTIONS)]
+        edf_files.append(write_edf(os.path.join(dirname, f'synthetic_{i:06d}.edf'), **file_kwargs))
+    return edf_files
@@ -16,6 +16,13 @@
 #   python channel_label_identifier . C3 C4
 # @example List all unique signal labels found in the current (.) directory
 # python channel_label_identifier .
+# Also writes <json filename>.npz: the label vocabulary and a bit-packed file x label matrix
+# (see loadLabelMatrix, filesWithLabels and filesWithCategories to query it).
+#
+# @example Select labels with a rules file instead of interactively (e.g. in a job array)
+#   python channel_label_identifier . montage.json --rules montage_rules.json
+# @example Read the headers of 32 files at a time
+# python channel_label_identifier . montage.json C3 C4 --jobs 32
 #
 # @author Hyatt Moore
 # @date 2/20/2018
@@ -24,20 +31,28 @@
 # @author Alexander Neergaard
 # @date 2021-04-21
 
+import argparse
 import json
+import re
 import sys
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
-try:
-    import mne
-except:
-    from pyedflib import EdfReader
-from tqdm import tqdm
+import numpy as np
 
-# from pyedflib import EdfReader
+sys.path.insert(0, str(Path(__file__).resolve().parent / "sherlock" / "edf_headers"))
+from discovery import MSLT_PATTERNS, scan  # noqa: E402
+from header_cache import HeaderCache, cached, default_cache_path  # noqa: E402
 
 JSON_FILENAME = "signal_labels.json"
+ANNOTATION_LABEL = "EDF Annotations"
+# Reading labels is I/O bound, so use more threads than cores
+DEFAULT_JOBS = 16
+# Files queued per thread ahead of the file being yielded
+IN_FLIGHT_PER_JOB = 4
+# .edf and .rec files, case-insensitive
+EDF_FILE_PATTERNS = ["*.edf", "*.rec"]
 
 
 # Wrapper for getEDFFiles
@@ -52,9 +67,8 @@ def getEDFFiles(path2check):
     # if so then list all .edf/.EDF files
     if p.is_dir():
         print("Checking", path2check, "for edf files.")
-        edfFiles = list(p.glob("**/*.[EeRr][DdEe][FfCc]"))  # make search case-insensitive
         print('Removing any MSLT studies.')
-        edfFiles = [edf for edf in edfFiles if not 'mslt' in edf.stem.lower()]
+        edfFiles = [Path(entry.path) for entry in scan(p, include=EDF_FILE_PATTERNS, exclude=MSLT_PATTERNS)]
     else:
         print(path2check, " is not a valid directory.")
         edfFiles = []
@@ -62,12 +76,15 @@ def getEDFFiles(path2check):
 
 
 def getSignalHeaders(edfFilename):
+    # Only for headers readHeaderLabels cannot parse, so pyedflib and MNE are imported here
     try:
         # print("Reading headers from ", edfFilename)
         try:
+            from pyedflib import EdfReader
             edfR = EdfReader(str(edfFilename))
             return edfR.getSignalHeaders()
         except:
+            import mne
             edfR = mne.io.read_raw_edf(str(edfFilename), verbose=False)
             return edfR.ch_names
     except:
@@ -75,7 +92,23 @@ def getSignalHeaders(edfFilename):
         return []
 
 
-def getChannelLabels(edfFilename):
+def readHeaderLabels(edfFilename):
+    # Only the label block of the header: ns * 16 bytes at offset 256
+    with open(edfFilename, "rb") as f:
+        fixed = f.read(256)
+        num_signals = int(fixed[252:256])
+        block = f.read(16 * num_signals)
+    if len(block) != 16 * num_signals:
+        raise ValueError(f"Truncated header: {edfFilename}")
+    labels = [block[i:i + 16].decode("latin-1").strip() for i in range(0, len(block), 16)]
+    return [label for label in labels if label != ANNOTATION_LABEL]
+
+
+def readChannelLabels(edfFilename):
+    try:
+        return readHeaderLabels(edfFilename)
+    except:
+        pass
     channelHeaders = getSignalHeaders(edfFilename)
     try:
         return [fields["label"] for fields in channelHeaders]
@@ -83,6 +116,16 @@ def getChannelLabels(edfFilename):
         return channelHeaders
 
 
+def getChannelLabels(edfFilename, cache=None):
+    # Labels of unchanged files come from the shared header cache (see sherlock/edf_headers/header_cache.py)
+    return cached(cache, "labels", edfFilename, readChannelLabels)
+
+
+def openHeaderCache():
+    cache_path = default_cache_path()
+    return HeaderCache(cache_path) if cache_path else None
+
+
 def displaySetSelection(label_set):
     numCols = 4
     curItem = 0
@@ -112,16 +155,106 @@ def getAllChannelLabels(path2check):
     return label_set, num_edfs
 
 
-def getAllChannelLabelsWithCounts(edfFiles):
-    num_edfs = len(edfFiles)
-    if num_edfs == 0:
-        label_list = []
-    else:
-        label_list = []
-        for edfFile in tqdm(edfFiles):
-            [label_list.append(l) for l in getChannelLabels(edfFile)]
-        label_set_counts = Counter(label_list)
-    return label_set_counts, num_edfs
+def finishChannelLabels(edfFile, labels, cache):
+    if isinstance(labels, Future):
+        labels = labels.result()
+        # [] is a failed read: don't keep it in the cache
+        if cache is not None and len(labels) > 0:
+            cache.put(edfFile, "labels", labels)
+    return labels
+
+
+def iterChannelLabels(edfFiles, cache=None, jobs=DEFAULT_JOBS):
+    """Yield the channel labels of each file, in order, reading up to `jobs` headers at a time.
+
+    At most IN_FLIGHT_PER_JOB * `jobs` files are queued ahead of the one being yielded, so
+    memory does not grow with the number of files."""
+    from tqdm import tqdm
+
+    window = deque()
+    maxInFlight = IN_FLIGHT_PER_JOB * jobs
+    # The cache is only used from this thread; sqlite connections are not shared between threads
+    with ThreadPoolExecutor(max_workers=jobs) as executor, tqdm(total=len(edfFiles)) as progress:
+        for edfFile in edfFiles:
+            labels = cache.get(edfFile, "labels") if cache is not None else None
+            window.append((edfFile, labels if labels is not None else executor.submit(readChannelLabels, edfFile)))
+            if len(window) >= maxInFlight:
+                progress.update()
+                yield finishChannelLabels(*window.popleft(), cache)
+
+        while len(window) > 0:
+            progress.update()
+            yield finishChannelLabels(*window.popleft(), cache)
+
+
+def getAllChannelLabelsWithCounts(edfFiles, cache=None, jobs=DEFAULT_JOBS):
+    label_set_counts = Counter()
+    for labels in iterChannelLabels(edfFiles, cache, jobs):
+        label_set_counts.update(labels)
+    return label_set_counts, len(edfFiles)
+
+
+def getLabelMatrix(edfFiles, cache=None, jobs=DEFAULT_JOBS):
+    """Sorted label vocabulary and boolean (file x label) matrix of which file has which label."""
+    vocabulary = {}  # label -> column, in order of first appearance
+    rows, cols = [], []
+    for row, labels in enumerate(iterChannelLabels(edfFiles, cache, jobs)):
+        for label in labels:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(label, len(vocabulary)))
+
+    matrix = np.zeros((len(edfFiles), len(vocabulary)), dtype=bool)
+    matrix[rows, cols] = True
+
+    labels = sorted(vocabulary)
+    order = [vocabulary[label] for label in labels]
+    return labels, matrix[:, order]
+
+
+def getLabelCounts(labels, matrix):
+    """Number of files with each label."""
+    return Counter(dict(zip(labels, matrix.sum(axis=0).tolist())))
+
+
+def saveLabelMatrix(npzFileOut, edfFiles, labels, matrix):
+    np.savez_compressed(
+        npzFileOut,
+        edfFiles=np.asarray(edfFiles, dtype=str),
+        labels=np.asarray(labels, dtype=str),
+        matrix=np.packbits(matrix, axis=1),
+        num_labels=len(labels),
+    )
+
+
+def loadLabelMatrix(npzFilename):
+    """edfFiles, labels and boolean (file x label) matrix saved by saveLabelMatrix."""
+    with np.load(npzFilename) as npz:
+        matrix = np.unpackbits(npz["matrix"], axis=1, count=int(npz["num_labels"])).astype(bool)
+        return npz["edfFiles"].tolist(), npz["labels"].tolist(), matrix
+
+
+def labelColumns(labels, selected):
+    column = {label: i for i, label in enumerate(labels)}
+    return [column[label] for label in selected if label in column]
+
+
+def filesWithLabels(edfFiles, labels, matrix, allOf=(), noneOf=()):
+    """Files having every label of `allOf` and none of `noneOf`, e.g. allOf=["C3"], noneOf=["M2"]."""
+    allCols = labelColumns(labels, allOf)
+    if len(allCols) < len(set(allOf)):
+        return []
+    keep = matrix[:, allCols].all(axis=1) & ~matrix[:, labelColumns(labels, noneOf)].any(axis=1)
+    return [edfFiles[i] for i in np.flatnonzero(keep)]
+
+
+def filesWithCategories(edfFiles, labels, matrix, montage, categories=None):
+    """Files having at least one label of every category of a montage JSON dict."""
+    if categories is None:
+        categories = montage["categories"]
+    keep = np.ones(len(edfFiles), dtype=bool)
+    for category in categories:
+        keep &= matrix[:, labelColumns(labels, montage[category])].any(axis=1)
+    return [edfFiles[i] for i in np.flatnonzero(keep)]
 
 
 def getLabelSet(edfFiles):
@@ -132,34 +265,94 @@ def getLabelSet(edfFiles):
     return label_set
 
 
+def loadRules(rulesFilename):
+    """Rules file: {category: [regex, ...]} or {category: {"aliases": [label, ...], "patterns": [regex, ...]}}.
+    Aliases are exact labels, patterns must match the whole label. Both are case-insensitive."""
+    with open(rulesFilename) as rules_file:
+        rules = json.load(rules_file)
+
+    compiled = {}
+    for category, rule in rules.items():
+        if isinstance(rule, list):
+            rule = {"patterns": rule}
+        patterns = [re.escape(alias) for alias in rule.get("aliases", [])] + rule.get("patterns", [])
+        compiled[category] = re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+    return compiled
+
+
+def matchRules(label_list, rules, categories):
+    """Labels of each category and the labels that match no category, in one pass over the vocabulary."""
+    selected = {category: [] for category in categories}
+    unmatched = []
+    for label in label_list:
+        matched = False
+        for category in categories:
+            if rules[category].fullmatch(label):
+                selected[category].append(label)
+                matched = True
+        if not matched:
+            unmatched.append(label)
+    return selected, unmatched
+
+
 def printUsage(toolName):
-    print("Usage:\n\t", toolName, " <pathname to search> <channel category> {<channel category>}")
-    print("Example:\n\t", toolName, " . C3 C4")
+    print("Usage:\n\t", toolName, " <pathname to search> <json filename> <channel category> {<channel category>} [--jobs N]")
+    print("Example:\n\t", toolName, " . montage.json C3 C4")
+
+
+def parseArgs(args):
+    parser = argparse.ArgumentParser(description="Identify the channel labels of .edf files and group them into categories.")
+    parser.add_argument("path2check", help="Path name with .edf files")
+    parser.add_argument("json_filename", nargs="?", default=JSON_FILENAME, help="JSON file to write the categories to")
+    parser.add_argument("channelsToID", nargs="*", help="Channel categories, e.g. C3 C4")
+    parser.add_argument("--rules", help="JSON file of label rules per category; no interactive selection")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"Number of headers read concurrently (default: {DEFAULT_JOBS})")
+    return parser.parse_args(args)
 
 
 def run(args):
-    path2check = args[0]
-    json_filename = args[1]
+    args = parseArgs(args)
+    path2check = args.path2check
+    json_filename = args.json_filename
     jsonFileOut = json_filename
     # jsonFileOut = Path('./src/config/signal_labels').joinpath(json_filename)
     # jsonFileOut = Path(path2check).joinpath(json_filename)
     # jsonFileOut = Path('/home/alexno/Documents/utils').joinpath(JSON_FILENAME)
     # jsonFileOut = Path(path2check).joinpath(JSON_FILENAME)
-    channelsToID = args[2:]
+    channelsToID = args.channelsToID
+    rules = None
+    if args.rules is not None:
+        rules = loadRules(args.rules)
+        if len(channelsToID) == 0:
+            channelsToID = list(rules)
+        missing = [ch for ch in channelsToID if ch not in rules]
+        if len(missing) > 0:
+            print(f"No rules for categories {missing} in {args.rules}")
+            return
 
     edfFiles = getEDFFilenames(path2check)
     num_edfs = len(edfFiles)
     if num_edfs == 0:
         print("No files found!")
     else:
-        label_set_counts, _ = getAllChannelLabelsWithCounts(edfFiles)
+        cache = openHeaderCache()
+        label_list, label_matrix = getLabelMatrix(edfFiles, cache, args.jobs)
+        if cache is not None:
+            cache.prune()
+            cache.close()
+
+        npzFileOut = Path(jsonFileOut).with_suffix(".npz")
+        saveLabelMatrix(npzFileOut, edfFiles, label_list, label_matrix)
+        print("Label matrix written to file:", npzFileOut)
+
+        label_set_counts = getLabelCounts(label_list, label_matrix)
         # print(label_set_counts)
         # label_set = getLabelSet(edfFiles)
-        label_list = sorted(list(label_set_counts.keys()))
         # label_list = sorted(label_set)
         print()
 
-        if len(channelsToID) > 0:
+        if len(channelsToID) > 0 and rules is None:
             print(
                 "Enter acceptable channel indices to use for the given identifier. \n"
                 "Use spaces to separate multiple indices. \n"
@@ -177,11 +370,23 @@ def run(args):
             toFile["edfFiles"] = edfFiles  # a list
             toFile["categories"] = channelsToID  # a list of strings
 
-            for ch in channelsToID:
-                indices = [int(num) for num in input(ch + ": ").split()]
-                selectedLabels = [label_list[i] for i in indices]
-                print("Selected: ", selectedLabels)
-                toFile[ch] = selectedLabels
+            if rules is not None:
+                selected, unmatched = matchRules(label_list, rules, channelsToID)
+                for ch in channelsToID:
+                    print(f"{ch}: Selected: ", selected[ch])
+                    toFile[ch] = selected[ch]
+                print(f"\n{len(unmatched)} labels match no category:")
+                displaySetSelection({label: label_set_counts[label] for label in unmatched})
+                print()
+            else:
+                for ch in channelsToID:
+                    indices = [int(num) for num in input(ch + ": ").split()]
+                    selectedLabels = [label_list[i] for i in indices]
+                    print("Selected: ", selectedLabels)
+                    toFile[ch] = selectedLabels
+
+            covered = filesWithCategories(edfFiles, label_list, label_matrix, toFile)
+            print(f"{len(covered)} of {num_edfs} EDFs have a label for every category.")
 
             with open(jsonFileOut, "w") as json_file:
                 json.dump(toFile, json_file, indent=4, sort_keys=True)
@@ -0,0 +1,169 @@
+"""
+Python version of deidentify_edf.rb: randomize the start date of every EDF under a path by
++/- 5 days and clear the local patient and recording identification.
+
+Only the header bytes of these fields are rewritten (one pwrite per file), so the signal
+data is never read or touched. One CSV row per file (old -> new start date) is written to
+the audit log.
+
+    python deidentify_edf.py <path> --audit deidentify_audit.csv --workers 8
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'sherlock' / 'edf_headers'))
+from discovery import EDF_PATTERNS, scan  # noqa: E402
+
+
+# Byte offsets of the fixed header fields, as sliced in sherlock/edf_headers/edf_reader.read_header_edf.
+# The three fields are contiguous, so they are rewritten with a single pwrite.
+VERSION = b'0       '
+PATIENT_ID = slice(8, 88)
+RECORDING_ID = slice(88, 168)
+START_DATE = slice(168, 176)
+
+INVALID_DATE = '00.00.00'
+CLIPPING_DATE = '01.01.85'
+# Date format is "dd.mm.yy"; EDF years 85-99 are 1985-1999, 00-84 are 2000-2084
+CLIPPING_YEAR = 85
+
+MAX_SHIFT_DAYS = 5
+
+AUDIT_COLUMNS = ['file', 'status', 'old_start_date', 'new_start_date', 'shift_days',
+                 'had_patient_id', 'had_recording_id', 'error']
+
+
+def parse_edf_date(edf_date):
+    day, month, year = [int(x) for x in edf_date.split('.')]
+    year += 1900 if year >= CLIPPING_YEAR else 2000
+    return datetime.date(year, month, day)
+
+
+def format_edf_date(date):
+    return date.strftime('%d.%m.%y')
+
+
+def deidentify_edf(edf_file, shift_days, dry_run=False):
+    """
+    Shift the start date of `edf_file` by `shift_days` and blank its patient and recording
+    identification, in place. Returns the audit record of the file.
+    """
+    fd = os.open(edf_file, os.O_RDONLY if dry_run else os.O_RDWR)
+    try:
+        fixed = os.pread(fd, START_DATE.stop, 0)
+        if len(fixed) < START_DATE.stop or fixed[:len(VERSION)] != VERSION:
+            raise Exception('Not an EDF file')
+
+        old_date = fixed[START_DATE].decode('ascii', errors='replace')
+        start_date = CLIPPING_DATE if old_date == INVALID_DATE else old_date
+        # Dates before the clipping date would read as 20xx
+        new_date = max(parse_edf_date(start_date) + datetime.timedelta(days=shift_days),
+                       parse_edf_date(CLIPPING_DATE))
+        new_date = format_edf_date(new_date)
+
+        record = {
+            'file': str(edf_file),
+            'status': 'OK',
+            'old_start_date': old_date,
+            'new_start_date': new_date,
+            'shift_days': shift_days,
+            'had_patient_id': len(fixed[PATIENT_ID].strip()) > 0,
+            'had_recording_id': len(fixed[RECORDING_ID].strip()) > 0,
+            'error': '',
+        }
+
+        if not dry_run:
+            patch = b' ' * (PATIENT_ID.stop - PATIENT_ID.start) + \
+                b' ' * (RECORDING_ID.stop - RECORDING_ID.start) + \
+                new_date.encode('ascii')
+            if os.pwrite(fd, patch, PATIENT_ID.start) != len(patch):
+                raise Exception('Short write')
+    finally:
+        os.close(fd)
+
+    return record
+
+
+def _deidentify_task(task, dry_run):
+    edf_file, shift_days = task
+    try:
+        return deidentify_edf(edf_file, shift_days, dry_run)
+    except Exception as e:
+        return {'file': str(edf_file), 'status': 'FAIL', 'shift_days': shift_days, 'error': str(e)}
+
+
+def find_edf_files(path):
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    return [Path(entry.path) for entry in scan(path, include=EDF_PATTERNS)]
+
+
+def deidentify_edfs(path, audit=None, workers=1, seed=None, dry_run=False):
+    edf_files = find_edf_files(path)
+    print(f'EDFs available: {len(edf_files)}')
+
+    rng = random.Random(seed)
+    tasks = [(edf_file, rng.randint(-MAX_SHIFT_DAYS, MAX_SHIFT_DAYS)) for edf_file in edf_files]
+    task = partial(_deidentify_task, dry_run=dry_run)
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(task, tasks, chunksize=16)
+    else:
+        executor = None
+        results = map(task, tasks)
+
+    audit_file = open(audit, 'w', newline='') if audit is not None else None
+    writer = csv.DictWriter(audit_file, fieldnames=AUDIT_COLUMNS) if audit_file is not None else None
+    if writer is not None:
+        writer.writeheader()
+
+    failed_files = []
+    for record in results:
+        if record['status'] == 'OK':
+            if record['old_start_date'] == INVALID_DATE:
+                print(f'   {INVALID_DATE} to {CLIPPING_DATE} for {record["file"]}')
+            print(f'   OK       {record["old_start_date"]}  --> {record["new_start_date"]} for {record["file"]}')
+        else:
+            print(f'   FAIL     {record["error"]} for {record["file"]}')
+            failed_files.append(record['file'])
+        if writer is not None:
+            writer.writerow(record)
+            audit_file.flush()
+
+    if executor is not None:
+        executor.shutdown()
+    if audit_file is not None:
+        audit_file.close()
+
+    print(f'\nFinished! {len(edf_files) - len(failed_files)} of {len(edf_files)} files de-identified'
+          f'{" (dry run)" if dry_run else ""}.')
+    for fail_file in failed_files:
+        print(fail_file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', default='.',
+                        help='EDF file or path searched recursively for .edf files (default: current directory)')
+    parser.add_argument('--audit', help='CSV file to write the old -> new start date of every file to')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes (default: 1)')
+    parser.add_argument('--seed', type=int, help='Seed of the random date shifts')
+    parser.add_argument('--dry-run', action='store_true', help='Report the new dates without changing any file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not Path(args.path).exists():
+        print(f'Invalid/nonexistent path given: {args.path}')
+        sys.exit(1)
+    deidentify_edfs(args.path, args.audit, args.workers, args.seed, args.dry_run)
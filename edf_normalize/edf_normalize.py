@@ -0,0 +1,250 @@
+"""
+Streaming EDF normalizer: header repair, channel culling and referencing.
+
+Python counterpart of edf_transcode/normalize_edfs.m and CLASS_converter.exportCulledEDF.
+Data records are read in chunks of CHUNK_RECORDS through a memory map and written record
+by record, so memory use does not depend on the length of the recording.
+
+Channels are chosen with the montage JSON written by channel_label_identifier.py: each
+output channel is a category ('EOGL') or the difference of two categories ('C3-A2'),
+using the first label of the category found in the file. With --samplerate, every output
+channel is resampled to that rate (see resample.py).
+
+    python edf_normalize.py <edf file or path> <destination path> --montage montage.json --channels C3-A2 C4-A1 EOGL EOGR LChin-RChin
+    python edf_normalize.py <edf file or path> <destination path> --montage montage.json --channels C3-A2 EOGL --samplerate 128
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'sherlock' / 'edf_headers'))
+from discovery import EDF_PATTERNS, scan  # noqa: E402
+from edf_mmap import EdfMmap  # noqa: E402
+from edf_writer import format_header  # noqa: E402
+
+
+CHUNK_RECORDS = 60
+DIGITAL_MIN = -32768
+DIGITAL_MAX = 32767
+
+
+class CopiedChannel:
+    """
+    Channel written unchanged (digital values and header fields).
+    """
+
+    def __init__(self, edf, label, index):
+        self.label = label
+        self.index = index
+        self.n_samples_per_record = int(edf.n_samples_per_record[index])
+        h = edf.header
+        self.header = {
+            'channels': label,
+            'transducer_type': h['transducer_type'][index],
+            'units': h['units'][index],
+            'physical_min': h['physical_min'][index],
+            'physical_max': h['physical_max'][index],
+            'digital_min': h['digital_min'][index],
+            'digital_max': h['digital_max'][index],
+            'prefiltering': h['prefiltering'][index],
+        }
+
+    def read(self, edf, first, last):
+        return edf.records(self.index)[first:last]
+
+
+class ReferencedChannel:
+    """
+    Difference of two channels sampled at the same rate (e.g. C3 - A2), computed in
+    physical units and re-quantized over the full 16-bit range.
+    """
+
+    def __init__(self, edf, label, index, ref_index):
+        if edf.n_samples_per_record[index] != edf.n_samples_per_record[ref_index]:
+            raise Exception(f'{label}: {edf.channels[index]} and {edf.channels[ref_index]} '
+                            f'have different sample rates')
+        h = edf.header
+        # A degenerate range gives a gain of 0 (or inf): the difference cannot be scaled
+        for i in (index, ref_index):
+            if h['physical_max'][i] == h['physical_min'][i] or h['digital_max'][i] <= h['digital_min'][i]:
+                raise Exception(f'{label}: {edf.channels[i]} has a degenerate range (physical '
+                                f'{h["physical_min"][i]:g} to {h["physical_max"][i]:g}, digital '
+                                f'{h["digital_min"][i]:g} to {h["digital_max"][i]:g})')
+        self.label = label
+        self.index = index
+        self.ref_index = ref_index
+        self.n_samples_per_record = int(edf.n_samples_per_record[index])
+
+        physical_min = h['physical_min'][index] - h['physical_max'][ref_index]
+        physical_max = h['physical_max'][index] - h['physical_min'][ref_index]
+        self.gain = (physical_max - physical_min) / (DIGITAL_MAX - DIGITAL_MIN)
+        self.offset = physical_max - self.gain * DIGITAL_MAX
+        self.header = {
+            'channels': label,
+            'transducer_type': h['transducer_type'][index],
+            'units': h['units'][index],
+            'physical_min': physical_min,
+            'physical_max': physical_max,
+            'digital_min': DIGITAL_MIN,
+            'digital_max': DIGITAL_MAX,
+            'prefiltering': h['prefiltering'][index],
+        }
+
+    def read(self, edf, first, last):
+        signal = edf.to_physical(self.index, edf.records(self.index)[first:last]) - \
+            edf.to_physical(self.ref_index, edf.records(self.ref_index)[first:last])
+        digital = np.rint((signal - self.offset) / self.gain)
+        return np.clip(digital, DIGITAL_MIN, DIGITAL_MAX).astype('<i2')
+
+
+class ResampledChannel:
+    """
+    Channel resampled to `sample_rate`, keeping its header fields.
+    """
+
+    def __init__(self, edf, channel, sample_rate):
+        # scipy is only imported with --samplerate
+        from resample import RecordResampler
+
+        n_samples_out = sample_rate * edf.record_length
+        if not float(n_samples_out).is_integer():
+            raise Exception(f'{sample_rate} Hz is not a whole number of samples per '
+                            f'{edf.record_length} s data record')
+        self.label = channel.label
+        self.channel = channel
+        self.header = channel.header
+        self.n_samples_per_record = int(n_samples_out)
+        self.resampler = RecordResampler(channel.n_samples_per_record, self.n_samples_per_record)
+
+    def read(self, edf, first, last):
+        ctx_first, ctx_last = self.resampler.context(first, last, edf.n_records)
+        records = self.channel.read(edf, ctx_first, ctx_last)
+        digital = np.rint(self.resampler.resample(records, first - ctx_first, last - first))
+        return np.clip(digital, self.header['digital_min'], self.header['digital_max']).astype('<i2')
+
+
+def find_label(edf, montage, category):
+    for label in montage.get(category, []):
+        if label in edf.channels:
+            return edf.channels.index(label)
+    return None
+
+
+def get_output_channels(edf, montage, outputs, sample_rate=None):
+    channels = []
+    for output in outputs:
+        categories = output.split('-', 1)
+        indices = [find_label(edf, montage, category) for category in categories]
+        if None in indices:
+            missing = [c for c, i in zip(categories, indices) if i is None]
+            print(f'{output}: no label of {missing} in {edf.edf_filename} -> SKIP channel.')
+        elif len(indices) == 1:
+            channels.append(CopiedChannel(edf, output, indices[0]))
+        else:
+            channels.append(ReferencedChannel(edf, output, *indices))
+
+    if sample_rate is not None:
+        channels = [ResampledChannel(edf, ch, sample_rate) for ch in channels]
+    return channels
+
+
+def get_output_header(edf, channels):
+    """
+    Header of the normalized file: the number of records is taken from the file size,
+    non-ASCII characters are replaced and only the output channels are listed.
+    """
+    h = edf.header
+    h_out = {
+        'local_subject_id': h['local_subject_id'],
+        'local_recording_id': h['local_recording_id'],
+        'date_time': h['date_time'],
+        'n_records': edf.n_records,
+        'record_length': edf.record_length,
+        'n_channels': len(channels),
+        'n_samples_per_record': [ch.n_samples_per_record for ch in channels],
+    }
+    for key in channels[0].header:
+        h_out[key] = [ch.header[key] for ch in channels]
+    return h_out
+
+
+def normalize_edf(src_file, dest_file, montage, outputs, sample_rate=None, chunk_records=CHUNK_RECORDS):
+    with EdfMmap(src_file) as edf:
+        if edf.n_records != edf.header['n_records']:
+            print(f'Number of data records in the header ({edf.header["n_records"]}) does not match '
+                  f'the file size, using {edf.n_records}.')
+
+        channels = get_output_channels(edf, montage, outputs, sample_rate)
+        if len(channels) == 0:
+            raise Exception(f'None of the channels {outputs} found in {src_file}')
+
+        columns = np.cumsum([0] + [ch.n_samples_per_record for ch in channels])
+        dest_file = Path(dest_file)
+        fd, tmp_name = tempfile.mkstemp(prefix=f'.{dest_file.name}.', suffix='.tmp', dir=dest_file.parent)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(format_header(get_output_header(edf, channels)))
+                for first in range(0, edf.n_records, chunk_records):
+                    last = min(first + chunk_records, edf.n_records)
+                    records = np.empty((last - first, columns[-1]), dtype='<i2')
+                    for ch, start, stop in zip(channels, columns[:-1], columns[1:]):
+                        records[:, start:stop] = ch.read(edf, first, last)
+                    out.write(records.tobytes())
+            os.replace(tmp_name, dest_file)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
+
+    return [ch.label for ch in channels]
+
+
+def get_edf_files(src_path):
+    src_path = Path(src_path)
+    if src_path.is_file():
+        return [src_path]
+    return [Path(entry.path) for entry in scan(src_path, include=EDF_PATTERNS, recursive=False)]
+
+
+def normalize_edfs(src_path, dest_path, montage_file, outputs, sample_rate=None, chunk_records=CHUNK_RECORDS):
+    with open(montage_file) as f:
+        montage = json.load(f)
+    os.makedirs(dest_path, exist_ok=True)
+
+    edf_files = get_edf_files(src_path)
+    failed_files = []
+    for i, edf_file in enumerate(edf_files):
+        dest_file = Path(dest_path) / edf_file.name
+        print(f'{i + 1} of {len(edf_files)} - {edf_file.name} ... ', end='')
+        try:
+            labels = normalize_edf(edf_file, dest_file, montage, outputs, sample_rate, chunk_records)
+            print(f'SUCCESS ({", ".join(labels)})')
+        except Exception as e:
+            print(f'FAIL | {e}')
+            failed_files.append(edf_file.name)
+
+    print(f'\n{len(failed_files)} of {len(edf_files)} files failed.')
+    for fail_file in failed_files:
+        print(fail_file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('src_path', help='EDF file or path with .edf files')
+    parser.add_argument('dest_path', help='Path to write the normalized .edf files to (may be src_path)')
+    parser.add_argument('--montage', required=True, help='Montage JSON from channel_label_identifier.py')
+    parser.add_argument('--channels', nargs='+', required=True,
+                        help="Output channels: a category ('EOGL') or two categories to reference ('C3-A2')")
+    parser.add_argument('--samplerate', type=float, help='Resample all output channels to this rate (Hz)')
+    parser.add_argument('--chunk-records', type=int, default=CHUNK_RECORDS,
+                        help=f'Data records read at a time (default: {CHUNK_RECORDS})')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    normalize_edfs(args.src_path, args.dest_path, args.montage, args.channels, args.samplerate, args.chunk_records)
@@ -0,0 +1,68 @@
+"""
+Chunked polyphase resampling of EDF channels.
+
+Records are resampled a chunk at a time with `scipy.signal.resample_poly`. Each chunk is
+extended by enough neighbouring records to cover the anti-aliasing filter, so the output
+equals resampling the whole channel at once (up to float rounding).
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+
+@lru_cache(maxsize=None)
+def get_filter(up, down):
+    """
+    Anti-aliasing FIR filter of resample_poly for a reduced up/down ratio, designed once
+    per ratio (e.g. 512 -> 128 Hz and 256 -> 64 Hz share the same filter).
+    """
+    max_rate = max(up, down)
+    h = firwin(2 * 10 * max_rate + 1, 1. / max_rate, window=('kaiser', 5.0))
+    h.flags.writeable = False
+    return h
+
+
+class RecordResampler:
+    """
+    Resample data records of `n_samples_in` samples to records of `n_samples_out` samples.
+
+        resampler = RecordResampler(512, 128)
+        ctx_first, ctx_last = resampler.context(first, last, n_records)
+        out = resampler.resample(records[ctx_first:ctx_last], first - ctx_first, last - first)
+    """
+
+    def __init__(self, n_samples_in, n_samples_out):
+        divisor = math.gcd(n_samples_in, n_samples_out)
+        self.n_samples_in = n_samples_in
+        self.n_samples_out = n_samples_out
+        self.up = n_samples_out // divisor
+        self.down = n_samples_in // divisor
+        if self.up == self.down:
+            self.h = None
+            self.pad_records = 0
+        else:
+            self.h = get_filter(self.up, self.down)
+            # Input samples on each side of an output sample that the filter reaches
+            half_len = (len(self.h) - 1) // 2
+            self.pad_records = math.ceil((half_len / self.up + 1) / n_samples_in)
+
+    def context(self, first, last, n_records):
+        """
+        Records to read to resample records [first, last).
+        """
+        return max(0, first - self.pad_records), min(n_records, last + self.pad_records)
+
+    def resample(self, records, offset, count):
+        """
+        Resample `count` records starting at record `offset` of `records`, which holds the
+        records returned by `context`. Returns a (count, n_samples_out) float array.
+        """
+        if self.h is None:
+            return np.asarray(records[offset:offset + count], dtype=float)
+
+        signal = np.asarray(records, dtype=float).reshape(-1)
+        resampled = resample_poly(signal, self.up, self.down, window=self.h)
+        start = offset * self.n_samples_out
+        return resampled[start:start + count * self.n_samples_out].reshape(count, self.n_samples_out)
@@ -1,8 +1,25 @@
 import sys
 from pyedflib import EdfReader
 from pathlib import Path
+import argparse
+import json
+import multiprocessing
+from multiprocessing.connection import wait
+import time
 import traceback
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'sherlock' / 'edf_headers'))
+from discovery import EDF_PATTERNS, Manifest, scan  # noqa: E402
+from header_cache import HeaderCache, default_cache_path  # noqa: E402
+
+
+SUCCESS = 'SUCCESS'
+FAIL = 'FAIL'
+TIMEOUT = 'TIMEOUT'
+CRASH = 'CRASH'
+
+DEFAULT_TIMEOUT = 600  # seconds per file, with --jobs > 1
+
 
 # Unused, but from Geoffrey Irving: https://stackoverflow.com/questions/8151300/ignore-case-in-glob-on-linux
 def insensitive_pattern(pattern):
@@ -11,7 +28,83 @@ def insensitive_pattern(pattern):
     return ''.join(map(either, pattern))
 
 
-def verify_edf_files(edf_path_to_verify: Path):
+def verify_edf_file(edf_file: Path):
+    try:
+        EdfReader(str(edf_file))
+        return {'ok': True, 'error': ''}
+    except Exception as Exc:
+        return {'ok': False, 'error': str(Exc)}
+
+
+def _verify_in_child(edf_file, conn):
+    conn.send(verify_edf_file(edf_file))
+    conn.close()
+
+
+def verify_serially(edf_files):
+    for edf_file in edf_files:
+        start = time.perf_counter()
+        result = verify_edf_file(edf_file)
+        yield edf_file, result, time.perf_counter() - start
+
+
+def verify_in_processes(edf_files, jobs, timeout):
+    """
+    Verify each file in its own process, at most `jobs` at a time, killing any that takes
+    longer than `timeout` seconds. Yields (edf_file, result, elapsed) in order of completion;
+    result is None on timeout or when the process died.
+    """
+    pending = list(reversed(edf_files))
+    running = {}  # connection -> (process, edf_file, start time)
+
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < jobs:
+            edf_file = pending.pop()
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_verify_in_child, args=(edf_file, send_conn), daemon=True)
+            process.start()
+            send_conn.close()
+            running[recv_conn] = (process, edf_file, time.perf_counter())
+
+        for conn in wait(list(running), timeout=0.1):
+            process, edf_file, start = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                # Killed before sending a result (e.g. out of memory): not a verdict on the file
+                result = None
+            conn.close()
+            process.join()
+            yield edf_file, result, time.perf_counter() - start
+
+        now = time.perf_counter()
+        for conn, (process, edf_file, start) in list(running.items()):
+            if timeout is not None and now - start > timeout:
+                # Process.kill() needs Python 3.7
+                process.terminate()
+                process.join()
+                conn.close()
+                del running[conn]
+                yield edf_file, None, now - start
+
+
+def find_edf_files(edf_path: Path, recursive=False, exclude=()):
+    """
+    `os.DirEntry` of the .edf files of a directory (their stat is cached).
+    """
+    return list(scan(edf_path, include=EDF_PATTERNS, exclude=exclude, recursive=recursive))
+
+
+def verify_edf_files(edf_path_to_verify: Path, jobs=1, timeout=None, report=None, recursive=False,
+                     exclude=(), manifest=None):
+    """
+    Verify that the .edf files of a directory open with pyedflib.EdfReader.
+
+    With `jobs` > 1 or a `timeout`, files are verified in separate processes so a corrupted
+    file cannot hang the run. One JSON record per file is written to `report` (a .jsonl file).
+    With a `manifest` file, only files that are new or changed since the last run with the
+    same manifest are verified.
+    """
     if not isinstance(edf_path_to_verify, Path):
         edf_path_to_verify = Path(edf_path_to_verify)
 
@@ -20,45 +113,97 @@ def verify_edf_files(edf_path_to_verify: Path):
     elif not edf_path_to_verify.exists():
         print(f'Path to edf files does not exist: {str(edf_path_to_verify)}')
     else:
-        edf_files_not_in_table = []
-        edf_files_in_table = []
         # Get all the files in the path
-        edf_files = edf_path_to_verify.glob('*.[eE][dD][fF]')
-        edf_file_count = len([name for name in edf_files if name.is_file()])
-        edf_files = edf_path_to_verify.glob('*.[eE][dD][fF]')
-        num_files = edf_file_count
+        entries = find_edf_files(edf_path_to_verify, recursive, exclude)
+        if manifest is not None:
+            num_found = len(entries)
+            manifest = Manifest(manifest).load()
+            entries = list(manifest.changed(entries))
+            print(f'{num_found - len(entries)} unchanged files in {manifest.path} -> SKIP.')
+        entries = {Path(entry.path): entry for entry in entries}
+        edf_files = list(entries)
+        num_files = len(edf_files)
         fail_files = []
         fail_reasons = []
+        status_counts = {SUCCESS: 0, FAIL: 0, TIMEOUT: 0, CRASH: 0}
 
         print(f'Verifying .edf files in {str(edf_path_to_verify)}\n\t{num_files} EDF files found.')
 
-        for i, edf_file in enumerate(edf_files):
-            edf_filename = edf_file.name
-            edf_stem = edf_file.stem.lower()
-            if edf_stem in edf_files_in_table:
-                edf_files_in_table.remove(edf_stem)
+        # Results for unchanged files come from the shared header cache
+        cache_path = default_cache_path()
+        cache = HeaderCache(cache_path) if cache_path else None
+        report_file = open(report, 'w') if report is not None else None
+        t_start = time.perf_counter()
+
+        def results():
+            to_verify = []
+            for edf_file in edf_files:
+                result = cache.get(edf_file, 'verify') if cache is not None else None
+                if result is not None:
+                    yield edf_file, result, 0.0
+                else:
+                    to_verify.append(edf_file)
+
+            if jobs > 1 or timeout is not None:
+                verified = verify_in_processes(to_verify, jobs, timeout)
             else:
-                edf_files_not_in_table.append(edf_filename)
+                verified = verify_serially(to_verify)
 
-            print(f'{i + 1:3d} of {num_files} - {edf_filename} ... ', end='')
-            try:
-                EdfReader(str(edf_file))
-                print('SUCCESS')
-            except Exception as Exc:
-                # traceback.print_exc(file=sys.stdout)
-                # traceback.print_exception(type(Exc), Exc, None)
-                # traceback.format_exception_only(type(Exc), Exc)
-                #
-                fail_reasons.append(str(Exc))
+            # Only verdicts of the verifier are cached, not timeouts or crashed processes
+            for edf_file, result, elapsed in verified:
+                if result is not None and cache is not None:
+                    cache.put(edf_file, 'verify', result)
+                yield edf_file, result, elapsed
+
+        for i, (edf_file, result, elapsed) in enumerate(results()):
+            edf_filename = str(edf_file.relative_to(edf_path_to_verify))
+            if result is None and timeout is not None and elapsed >= timeout:
+                status, error = TIMEOUT, f'No result after {timeout} s'
+            elif result is None:
+                status, error = CRASH, 'Verification process died without a result'
+            elif result['ok']:
+                status, error = SUCCESS, ''
+            else:
+                status, error = FAIL, result['error']
+            status_counts[status] += 1
+            if manifest is not None and status not in (TIMEOUT, CRASH):
+                manifest.add(entries[edf_file])
+
+            print(f'{i + 1:3d} of {num_files} - {edf_filename} ... {status}')
+            if status != SUCCESS:
+                fail_reasons.append(error)
                 fail_files.append(edf_filename)
-                print('FAIL')
+
+            if report_file is not None:
+                record = {
+                    'file': str(edf_file),
+                    'status': status,
+                    'exception': error,
+                    'elapsed': elapsed,
+                    'file_size': entries[edf_file].stat().st_size,
+                }
+                report_file.write(json.dumps(record) + '\n')
+                report_file.flush()
+
+        elapsed_total = time.perf_counter() - t_start
+        if report_file is not None:
+            report_file.close()
+        if cache is not None:
+            cache.prune()
+            cache.close()
+        if manifest is not None:
+            manifest.save()
 
         print('')
+        print(f'{num_files} files in {elapsed_total:.1f} s ({num_files / max(elapsed_total, 1e-9):.1f} files/s): ' +
+              ', '.join(f'{n} {status}' for status, n in status_counts.items()))
         print(f'{len(fail_files)} files failed:')
         if len(fail_files) > 0:
             for idx, fail_file in enumerate(fail_files):
                 print(fail_file + '\t' + fail_reasons[idx])
             print('')
+        if report is not None:
+            print(f'Report written to {report}')
 
 
 def main_menu():
@@ -77,12 +222,34 @@ def main_menu():
             verify_edf_files(choice)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Verify that .edf files can be read with pyedflib.EdfReader.')
+    parser.add_argument('path', type=Path, help='Path to check')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of files verified in parallel (default: 1)')
+    parser.add_argument('--timeout', type=float,
+                        help='Seconds before a file is reported as TIMEOUT, 0 for none '
+                             f'(default: {DEFAULT_TIMEOUT} with --jobs > 1, none otherwise)')
+    parser.add_argument('--report', help='Write one JSON record per file to this .jsonl file')
+    parser.add_argument('-r', '--recursive', action='store_true', help='Also verify files in subdirectories')
+    parser.add_argument('--exclude', action='append', default=[],
+                        help="Skip files matching this pattern, e.g. '*mslt*' (may be repeated)")
+    parser.add_argument('--manifest', help='Only verify files that are new or changed since the last run with this file')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
     nargin = len(sys.argv)
 
-    # if no input arguments or too many input arguments
-    if nargin < 2 or nargin > 3:
+    # if no input arguments
+    if nargin < 2:
         main_menu()
     else:
-        src_path = Path(sys.argv[1])
-        verify_edf_files(src_path)
+        args = parse_args()
+        # Files are only verified in separate processes with --jobs > 1 or a --timeout
+        if args.timeout is None:
+            timeout = DEFAULT_TIMEOUT if args.jobs > 1 else None
+        else:
+            timeout = args.timeout if args.timeout > 0 else None
+        verify_edf_files(args.path, jobs=args.jobs, timeout=timeout,
+                         report=args.report, recursive=args.recursive, exclude=args.exclude,
+                         manifest=args.manifest)
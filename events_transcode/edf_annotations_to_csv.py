@@ -0,0 +1,170 @@
+"""
+Extract the annotations of EDF+ files to event .csv files, without MNE.
+
+Only the 'EDF Annotations' signal is read: its bytes are taken out of each data record
+through a memory map (see sherlock/edf_headers/edf_mmap.py), a chunk of records at a
+time, and the time-stamped annotation lists (TALs) are split at the byte level.
+
+The .csv files have the layout of the Stages event exports handled by
+remove_dates_from_evt_files.py:
+
+    Start Time,Duration (seconds),Event
+    5/22/2018 8:16:00 PM, 30.000, Sleep stage W
+
+Start times have whole seconds, like the Stages exports.
+
+    python edf_annotations_to_csv.py <edf file or path> <destination path> [--workers N] [--recursive]
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'sherlock' / 'edf_headers'))
+from discovery import EDF_PATTERNS, scan  # noqa: E402
+from edf_check import ANNOTATION_LABEL  # noqa: E402
+from edf_mmap import EdfMmap  # noqa: E402
+from edf_reader import parse_date_time  # noqa: E402
+
+
+CHUNK_RECORDS = 1000
+CSV_HEADER = 'Start Time,Duration (seconds),Event\n'
+
+# TAL separators (EDF+ specification, section 2.2.2)
+ONSET_END = b'\x14'
+DURATION_START = b'\x15'
+TAL_END = b'\x00'
+
+
+def parse_tals(data):
+    """
+    Yield (onset, duration, text) for every annotation in the bytes of one or more
+    annotation records. Time-keeping TALs (no text) are skipped; duration is None when
+    not given.
+    """
+    for tal in data.split(TAL_END):
+        if len(tal) == 0:
+            continue
+        fields = tal.split(ONSET_END)
+        texts = [t for t in fields[1:] if len(t) > 0]
+        if len(texts) == 0:
+            continue
+
+        onset, _, duration = fields[0].partition(DURATION_START)
+        onset = float(onset)
+        duration = float(duration) if len(duration) > 0 else None
+        for text in texts:
+            yield onset, duration, text.decode('utf-8', errors='replace')
+
+
+def read_annotations(edf_filename, chunk_records=CHUNK_RECORDS):
+    """
+    (start datetime, [(onset, duration, text), ...] sorted by onset) of an EDF+ file.
+    """
+    with EdfMmap(edf_filename) as edf:
+        if ANNOTATION_LABEL not in edf.channels:
+            raise Exception(f'No `{ANNOTATION_LABEL}` signal')
+        records = edf.records(ANNOTATION_LABEL)
+
+        annotations = []
+        for first in range(0, edf.n_records, chunk_records):
+            data = records[first:first + chunk_records].tobytes()
+            annotations.extend(parse_tals(data))
+        start = parse_date_time(edf.header['date_time'])
+
+    annotations.sort(key=lambda a: a[0])
+    return start, annotations
+
+
+def format_stages_time(t):
+    return f'{t.month}/{t.day}/{t.year} {t.hour % 12 or 12}:{t.minute:02d}:{t.second:02d} {"AM" if t.hour < 12 else "PM"}'
+
+
+def format_event(start, onset, duration, text):
+    t = start + datetime.timedelta(seconds=int(onset // 1))
+    # Commas would split the event text into extra columns
+    return f'{format_stages_time(t)}, {duration or 0:.3f}, {text.replace(",", ";")}\n'
+
+
+def edf_annotations_to_csv(edf_filename, csv_filename):
+    """
+    Write the annotations of `edf_filename` to `csv_filename` (through a temporary file in
+    the same directory). Returns the number of events.
+    """
+    start, annotations = read_annotations(edf_filename)
+
+    csv_filename = Path(csv_filename)
+    fd, tmp_name = tempfile.mkstemp(prefix=f'.{csv_filename.name}.', suffix='.tmp', dir=csv_filename.parent)
+    try:
+        with os.fdopen(fd, 'w') as out:
+            out.write(CSV_HEADER)
+            out.writelines(format_event(start, *a) for a in annotations)
+        os.replace(tmp_name, csv_filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+    return len(annotations)
+
+
+def _annotations_task(edf_filename, dest_path):
+    csv_filename = Path(dest_path) / (Path(edf_filename).stem + '.csv')
+    try:
+        return edf_filename, edf_annotations_to_csv(edf_filename, csv_filename), None
+    except Exception as e:
+        return edf_filename, 0, str(e)
+
+
+def edf_annotations_to_csvs(src_path, dest_path, workers=1, recursive=False):
+    src_path = Path(src_path)
+    if src_path.is_file():
+        edf_files = [str(src_path)]
+    else:
+        edf_files = [entry.path for entry in scan(src_path, include=EDF_PATTERNS, recursive=recursive)]
+    os.makedirs(dest_path, exist_ok=True)
+
+    task = partial(_annotations_task, dest_path=dest_path)
+    start = time.perf_counter()
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(task, edf_files, chunksize=4)
+    else:
+        executor = None
+        results = map(task, edf_files)
+
+    failed_files = []
+    num_events = 0
+    for i, (edf_filename, n, error) in enumerate(results):
+        num_events += n
+        if error is None:
+            print(f'{i + 1} of {len(edf_files)} - {edf_filename} ... {n} events')
+        else:
+            print(f'{i + 1} of {len(edf_files)} - {edf_filename} ... FAIL | {error}')
+            failed_files.append(edf_filename)
+    if executor is not None:
+        executor.shutdown()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'\n{len(edf_files)} files, {num_events} events in {elapsed:.2f} s ({len(edf_files) / elapsed:.1f} files/s)')
+    if len(failed_files) > 0:
+        print(f'\n{len(failed_files)} files failed: ')
+        for i, file in enumerate(failed_files):
+            print(f'{i+1}. {file}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('src_path', help='EDF+ file or path with .edf files')
+    parser.add_argument('dest_path', help='Path to write the event .csv files to')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes (default: 1)')
+    parser.add_argument('-r', '--recursive', action='store_true', help='Also convert files in subdirectories')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    edf_annotations_to_csvs(args.src_path, args.dest_path, args.workers, args.recursive)
@@ -1,12 +1,132 @@
 from pathlib import Path
+import argparse
+import os
+import re
+import shutil
 import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime # https://docs.python.org/3/library/datetime.html
+from functools import lru_cache, partial
 
 
 __DRY_RUN__ = False
 
+# Event files repeat the same timestamps many times (e.g. one event per 30 s epoch plus
+# user events at the same second), so conversions are cached.
+TIMESTAMP_CACHE_SIZE = 2 ** 16
 
-def remove_dates_from_evt_files(pathname=None, filename=None):
+DAYS_IN_MONTH = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# str.isdigit() also accepts non-ASCII digits, which strptime rejects
+ASCII_DIGITS = re.compile('[0-9]+')
+
+
+def parse_stages_time(timestamp):
+    """
+    Fast path of convert_timestamp for 'M/D/YYYY h:mm:ss AM/PM'. Returns 'HH:MM:SS',
+    or None for anything it does not recognize (strptime then decides).
+    """
+    try:
+        date, clock, am_pm = timestamp.split(' ')
+        month, day, year = date.split('/')
+        hour, minute, second = clock.split(':')
+    except ValueError:
+        return None
+
+    digits = month + day + year + hour + minute + second
+    if not (ASCII_DIGITS.fullmatch(digits) and len(year) == 4 and
+            0 < len(month) < 3 and 0 < len(day) < 3 and
+            0 < len(hour) < 3 and 0 < len(minute) < 3 and 0 < len(second) < 3):
+        return None
+
+    month, day, year = int(month), int(day), int(year)
+    hour, minute, second = int(hour), int(minute), int(second)
+    am_pm = am_pm.upper()
+    if am_pm != 'AM' and am_pm != 'PM':
+        return None
+    if not (1 <= hour <= 12 and minute <= 59 and second <= 59 and 1 <= month <= 12 and day >= 1):
+        return None
+    if day > DAYS_IN_MONTH[month - 1]:
+        leap_year = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+        if not (month == 2 and day == 29 and leap_year):
+            return None
+
+    if am_pm == 'PM':
+        hour = hour % 12 + 12
+    elif hour == 12:
+        hour = 0
+    return f'{hour:02d}:{minute:02d}:{second:02d}'
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def convert_timestamp(timestamp):
+    """
+    '5/22/2018 8:16:00 PM' -> '20:16:00', or None when `timestamp` is not in that format.
+    """
+    converted = parse_stages_time(timestamp)
+    if converted is not None:
+        return converted
+
+    # strptime is slow (locale lock and regex match per call): only for unusual lines
+    try:
+        timestamp_object = datetime.strptime(timestamp, '%m/%d/%Y %I:%M:%S %p')
+    except ValueError:
+        return None
+    return timestamp_object.strftime('%H:%M:%S')
+
+
+def remove_date_from_line(line):
+    # change the datetime format so it is just the time
+    timestamp, separator, remainder = line.partition(',')
+    timestamp = convert_timestamp(timestamp)
+    if timestamp is None:
+        return line
+    return timestamp + separator + remainder
+
+
+def remove_dates_from_evt_file(filename, dry_run=__DRY_RUN__):
+    """
+    Rewrite one event file line by line. The output goes to a temporary file in the same
+    directory which then replaces the original, so an interrupted run never leaves a
+    truncated file. Returns the number of lines.
+    """
+    filename = Path(filename)
+    num_lines = 0
+    #Start Time,Duration (seconds),Event
+    #5/22/2018 8:16:00 PM, 30.000, Wake
+    #5/22/2018 8:16:13 PM, 0.000, Custom User Event 4
+    if dry_run:
+        with open(filename, 'r') as fid:
+            for line in fid:
+                print(remove_date_from_line(line), end='')
+                num_lines += 1
+        return num_lines
+
+    fd, tmp_name = tempfile.mkstemp(prefix=f'.{filename.name}.', suffix='.tmp', dir=filename.parent)
+    try:
+        with open(filename, 'r') as fid, os.fdopen(fd, 'w') as out:
+            for line in fid:
+                out.write(remove_date_from_line(line))
+                num_lines += 1
+        shutil.copymode(filename, tmp_name)
+        # write the csv file over the old one
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+    return num_lines
+
+
+def _remove_dates_task(filename, dry_run):
+    try:
+        return filename, remove_dates_from_evt_file(filename, dry_run), None
+    except UnicodeDecodeError as err:
+        return filename, 0, str(err)
+
+
+def remove_dates_from_evt_files(pathname=None, filename=None, dry_run=__DRY_RUN__, workers=1):
 
     if pathname is not None and filename is not None:
         print('Method expects either pathname or filename to be given, but not both.')
@@ -20,17 +140,32 @@ def remove_dates_from_evt_files(pathname=None, filename=None):
         elif not pathname.is_dir():
             print(f'Invalid/nonexistent pathname given: {str(pathname)}')
         else:
-            filenames = pathname.glob('*.[Cc][Ss][Vv]')
-            # filenames = glob.glob(pathname, '*.[Cc][Ss][Vv]')
+            filenames = sorted(pathname.glob('*.[Cc][Ss][Vv]'))
             failed_files = []
-            for filename in filenames:
-                try:
-                    print(f'Removing dates from {str(filename)} . . . ', end='')
-                    remove_dates_from_evt_files(filename=filename)
-                    print('done.')
-                except UnicodeDecodeError:
-                    print('FAIL.')
+            num_lines = 0
+            start = time.perf_counter()
+
+            task = partial(_remove_dates_task, dry_run=dry_run)
+            if workers > 1 and not dry_run:
+                executor = ProcessPoolExecutor(max_workers=workers)
+                results = executor.map(task, filenames, chunksize=16)
+            else:
+                executor = None
+                results = map(task, filenames)
+
+            for filename, n, error in results:
+                num_lines += n
+                if error is None:
+                    print(f'Removing dates from {str(filename)} . . . done.')
+                else:
+                    print(f'Removing dates from {str(filename)} . . . FAIL.')
                     failed_files.append(str(filename))
+            if executor is not None:
+                executor.shutdown()
+
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print(f'\n{len(filenames)} files, {num_lines} lines in {elapsed:.2f} s '
+                  f'({len(filenames) / elapsed:.1f} files/s, {num_lines / elapsed:.0f} lines/s)')
 
             if len(failed_files):
                 print(f'\n{len(failed_files)} files failed: ')
@@ -44,57 +179,37 @@ def remove_dates_from_evt_files(pathname=None, filename=None):
         elif not filename.is_file():
             print(f'Invalid/nonexistent filename given: {str(filename)}')
         else:
-            output = []
-            contents = None
-            with open(filename, 'r') as fid:
-                # read_csv_files
-                contents = list(fid)
-                # contents = fid.readlines()
-                # contents = fid.read()
-            if contents is not None:
-                #Start Time,Duration (seconds),Event
-                #5/22/2018 8:16:00 PM, 30.000, Wake
-                #5/22/2018 8:16:13 PM, 0.000, Custom User Event 4
-                for line in contents:
-                    # change the datetime format so it is just the staticmethod
-                    timestamp, separator, remainder = line.partition(',')
-                    try:
-                        timestamp_object = datetime.strptime(timestamp, '%m/%d/%Y %I:%M:%S %p')
-                        timestamp = timestamp_object.strftime('%H:%M:%S')
-                        output.append(timestamp+separator+remainder)
-                    except ValueError as err:
-                        output.append(line)
-                if __DRY_RUN__:
-                    for line in output:
-                        print(line)
-                else:
-                    # write the csv file over the old one
-                    with open(filename, 'w') as fid:
-                        fid.writelines(output)
-
+            remove_dates_from_evt_file(filename, dry_run)
 
 
 def print_usage(name='remove_dates_from_evt_files'):
-    print('\nUsage: python -m remove_date_from_evt_files [filename|pathname]\n\n')
+    print('\nUsage: python -m remove_date_from_evt_files [filename|pathname] [--dry-run] [--workers N]\n\n')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Remove the dates from the Start Time column of event .csv files.')
+    parser.add_argument('name', help='Event .csv file or directory of event .csv files')
+    parser.add_argument('--dry-run', action='store_true', default=__DRY_RUN__,
+                        help='Print the converted lines instead of rewriting the files')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes converting files of a directory (default: 1)')
+    return parser.parse_args()
 
 
 # https://docs.python.org/3/library/__main__.html
 if __name__ == '__main__':
     num_args = len(sys.argv)
-    if num_args == 2:
-        ambiguous_name = Path(sys.argv[1])
+    if num_args >= 2:
+        args = parse_args()
+        ambiguous_name = Path(args.name)
         if ambiguous_name.is_dir():
             print('A path')
-            remove_dates_from_evt_files(pathname=str(ambiguous_name))
+            remove_dates_from_evt_files(pathname=str(ambiguous_name), dry_run=args.dry_run, workers=args.workers)
         elif ambiguous_name.is_file():
             print(str(ambiguous_name), 'is a file')
-            remove_dates_from_evt_files(filename=str(ambiguous_name))
+            remove_dates_from_evt_files(filename=str(ambiguous_name), dry_run=args.dry_run)
         else:
             print(f'Invalid/nonexistent filename or path given: {str(ambiguous_name)}')
             print_usage(sys.argv[0])
     else:
         print_usage(sys.argv[0])
-
-
-
-
@@ -0,0 +1,41 @@
+import json
+import os
+
+from utils import remove_if_exists
+from const import CHECKPOINT_SUFFIX
+
+
+class Checkpoint:
+    """
+    Progress of an interrupted run: cohorts whose rows are all flushed and the
+    last flushed file. Removed when the run finishes, so a later "skip existing"
+    run still scans every cohort for new files.
+    """
+
+    def __init__(self, csv_path):
+        self.path = csv_path + CHECKPOINT_SUFFIX
+        self.done_cohorts = []
+        self.last_file = None
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self.done_cohorts = state['done_cohorts']
+            self.last_file = state['last_file']
+            print(f'Resuming after {self.last_file} | finished cohorts: {self.done_cohorts}')
+        return self
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'done_cohorts': self.done_cohorts, 'last_file': self.last_file}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def cohort_done(self, cohort):
+        if cohort not in self.done_cohorts:
+            self.done_cohorts.append(cohort)
+        self.save()
+
+    def remove(self):
+        remove_if_exists(self.path)
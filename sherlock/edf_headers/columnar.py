@@ -0,0 +1,221 @@
+"""
+Parquet output of run.py (`--parquet DIR`): a file-level and a channel-level table with
+all the fields parsed by read_header_edf.
+
+Each table is a directory of Parquet files (a dataset) with one part file per run (and
+shard). Rows are appended to it in row groups of ROW_GROUP_SIZE as the scan runs; the part
+file is written under a hidden name and only appears in the table once the run ends, so
+readers never see a file without its footer. Read the tables with pyarrow.dataset:
+
+    import pyarrow.dataset as ds
+    channels = ds.dataset('DIR/channels', format='parquet')
+    channels.to_table(filter=(ds.field('label') == 'C3-M2') & (ds.field('sample_rate') >= 256))
+"""
+import glob
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+FILES_TABLE = 'files'
+CHANNELS_TABLE = 'channels'
+ROW_GROUP_SIZE = 100000
+
+FILES_SCHEMA = pa.schema([
+    ('file_stem', pa.string()),
+    ('extension', pa.string()),
+    ('cohort', pa.string()),
+    ('path', pa.string()),
+    ('file_size_mb', pa.float64()),
+    ('start_date', pa.string()),
+    ('start_time', pa.string()),
+    ('duration_hours', pa.float64()),
+    ('n_records', pa.int64()),
+    ('record_length', pa.float64()),
+    ('n_channels', pa.int32()),
+    ('edf_plus', pa.int8()),
+    ('contiguous', pa.bool_()),
+    ('edf_compliant', pa.int8()),
+    ('fingerprint', pa.string()),
+    ('error', pa.string()),
+])
+
+CHANNELS_SCHEMA = pa.schema([
+    ('file_stem', pa.string()),
+    ('cohort', pa.string()),
+    ('channel', pa.int32()),
+    ('label', pa.string()),
+    ('transducer_type', pa.string()),
+    ('units', pa.string()),
+    ('physical_min', pa.float64()),
+    ('physical_max', pa.float64()),
+    ('digital_min', pa.float64()),
+    ('digital_max', pa.float64()),
+    ('prefiltering', pa.string()),
+    ('n_samples_per_record', pa.int32()),
+    ('sample_rate', pa.float64()),
+    # Signal QC (`run.py --qc`), null otherwise
+    ('clipped_min_fraction', pa.float64()),
+    ('clipped_max_fraction', pa.float64()),
+    ('flat_fraction', pa.float64()),
+    ('max_flat_seconds', pa.float64()),
+    ('gap_fraction', pa.float64()),
+    ('rms', pa.float64()),
+])
+
+
+def file_record(edf_filename, all_header, header, error_msg):
+    record = {key: all_header.get(key) for key in FILES_SCHEMA.names}
+    record['path'] = edf_filename
+    record['error'] = error_msg
+    if header is not None:
+        record['n_records'] = header['n_records']
+        record['record_length'] = header['record_length']
+        record['n_channels'] = header['n_channels']
+        record['contiguous'] = header['contiguous']
+    return record
+
+
+def channel_records(all_header, header, channel_qc=None):
+    if header is None:
+        return []
+
+    record_length = header['record_length']
+    records = []
+    for i, label in enumerate(header['channels']):
+        n_samples = header['n_samples_per_record'][i]
+        records.append({
+            'file_stem': all_header['file_stem'],
+            'cohort': all_header['cohort'],
+            'channel': i,
+            'label': label,
+            'transducer_type': header['transducer_type'][i],
+            'units': header['units'][i],
+            'physical_min': float(header['physical_min'][i]),
+            'physical_max': float(header['physical_max'][i]),
+            'digital_min': float(header['digital_min'][i]),
+            'digital_max': float(header['digital_max'][i]),
+            'prefiltering': header['prefiltering'][i],
+            'n_samples_per_record': n_samples,
+            'sample_rate': n_samples / record_length if record_length > 0 else None,
+        })
+        if channel_qc is not None and i in channel_qc:
+            records[-1].update(channel_qc[i])
+    return records
+
+
+class ParquetDatasetSink:
+    """
+    Rows of one table, appended to the part file `<prefix>.parquet` a row group at a time.
+    Rows are buffered per column, as `pa.Table.from_pylist` needs pyarrow >= 7 (Python >= 3.7).
+    """
+
+    def __init__(self, path, schema, prefix):
+        self.path = path
+        self.schema = schema
+        self.part_path = os.path.join(path, f'{prefix}.parquet')
+        self.tmp_path = os.path.join(path, f'.{prefix}.parquet.tmp')
+        self._columns = {name: [] for name in schema.names}
+        self._n_rows = 0
+        self._writer = None
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, records):
+        for record in records:
+            for name, values in self._columns.items():
+                values.append(record.get(name))
+        self._n_rows += len(records)
+
+    def _write(self, n_rows):
+        table = pa.Table.from_pydict({name: values[:n_rows] for name, values in self._columns.items()},
+                                     schema=self.schema)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        self._writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        for values in self._columns.values():
+            del values[:n_rows]
+        self._n_rows -= n_rows
+
+    def flush(self):
+        """
+        Write the full row groups buffered so far.
+        """
+        while self._n_rows >= ROW_GROUP_SIZE:
+            self._write(ROW_GROUP_SIZE)
+
+    def close(self):
+        if self._n_rows > 0:
+            self._write(self._n_rows)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self.tmp_path, self.part_path)
+
+
+class ColumnarOutput:
+    """
+    File and channel tables under `path`, written alongside the CSVs. Part files are
+    named after `tag` (e.g. the shard), so shards can write to the same tables.
+    """
+
+    def __init__(self, path, tag=''):
+        self.path = path
+        remove_unfinished_parts(path, tag)
+        # One prefix per run, so a resumed run adds a part next to the previous ones
+        prefix = f'part-{tag + "-" if tag else ""}{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}'
+        self.files = ParquetDatasetSink(os.path.join(path, FILES_TABLE), FILES_SCHEMA, prefix)
+        self.channels = ParquetDatasetSink(os.path.join(path, CHANNELS_TABLE), CHANNELS_SCHEMA, prefix)
+
+    def add(self, edf_filename, all_header, header, channel_qc, error_msg):
+        self.files.add([file_record(edf_filename, all_header, header, error_msg)])
+        self.channels.add(channel_records(all_header, header, channel_qc))
+
+    def flush(self):
+        self.files.flush()
+        self.channels.flush()
+
+    def close(self):
+        self.files.close()
+        self.channels.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def remove_unfinished_parts(path, tag=''):
+    """
+    Delete the hidden part files left by a run (with `tag`) that was killed: they have no
+    footer, so the rows of that run are lost from the tables.
+    """
+    # Without a tag, leave the parts of shards (`part-shard-...`) that may be running
+    pattern = f'.part-{tag}-*.parquet.tmp' if tag else '.part-[0-9]*.parquet.tmp'
+    for table in [FILES_TABLE, CHANNELS_TABLE]:
+        for fname in glob.glob(os.path.join(path, table, pattern)):
+            print(f'Removing the Parquet part of an interrupted run: {fname}')
+            os.remove(fname)
+
+
+def remove_tables(path, tag=''):
+    """
+    Delete the part files of both tables (a fresh run starts from empty tables), or only
+    those written with `tag`.
+    """
+    for table in [FILES_TABLE, CHANNELS_TABLE]:
+        for fname in glob.glob(os.path.join(path, table, f'part-{tag}*.parquet')):
+            os.remove(fname)
+
+
+def files_with_channel(path, label, min_sample_rate=0):
+    """
+    (file_stem, cohort, sample_rate) of the files with a channel `label` sampled at
+    `min_sample_rate` Hz or more, read with predicate pushdown.
+    """
+    channels = ds.dataset(os.path.join(path, CHANNELS_TABLE), format='parquet')
+    return channels.to_table(columns=['file_stem', 'cohort', 'sample_rate'],
+                             filter=(ds.field('label') == label) & (ds.field('sample_rate') >= min_sample_rate))
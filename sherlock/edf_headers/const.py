@@ -1,6 +1,33 @@
 CONFIG_PATH = 'config.json'
 FILE_EXT = '*.[Ee][Dd][Ff]'
 
+# Number of files handed to a worker process at a time (`run.py --workers N`)
+POOL_CHUNKSIZE = 4
+
+# Output CSVs are flushed every CSV_FLUSH_ROWS rows or CSV_FLUSH_SECONDS seconds
+CSV_FLUSH_ROWS = 500
+CSV_FLUSH_SECONDS = 30
+FLOAT_FORMAT = '%.3f'
+PARTIAL_SUFFIX = '.partial'
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+
+# Cache of parsed EDF headers shared by the EDF tools (see header_cache.py)
+HEADER_CACHE_ENV = 'EDF_HEADER_CACHE'
+HEADER_CACHE_PATH = '~/.cache/stages_utility/edf_headers.sqlite'
+HEADER_CACHE_MAX_ENTRIES = 1000000
+
+# Signal QC (`run.py --qc`, see signal_qc.py): data records are read QC_BLOCK_BYTES at a
+# time; a channel is listed in the dictionary when its share of clipped, flat (runs of
+# QC_FLAT_SECONDS or more) or gap samples reaches the threshold
+QC_BLOCK_BYTES = 8 * 2 ** 20
+QC_FLAT_SECONDS = 5
+QC_CLIPPED_FRACTION = 0.01
+QC_FLAT_FRACTION = 0.1
+QC_GAP_FRACTION = 0.1
+
+# Data records hashed into the content fingerprint of a file (`run.py --fingerprint`)
+FINGERPRINT_RECORDS = 4
+
 class EDF_COMPLIANT:
     SUCCESS = 1
-    ERROR = 0
\ No newline at end of file
+    ERROR = 0
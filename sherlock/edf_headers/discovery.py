@@ -0,0 +1,103 @@
+"""
+File discovery shared by the EDF tools.
+
+`scan` walks a directory tree with `os.scandir`, which returns the file type with the
+directory listing and caches `stat()` on each `os.DirEntry`, so no file is stat'ed twice.
+A `Manifest` remembers the size and modification time of the files handled by a previous
+run, so a later run can skip the files that did not change.
+
+    for entry in scan('/oak/psg', include=EDF_PATTERNS, exclude=MSLT_PATTERNS):
+        print(entry.path, entry.stat().st_size)
+"""
+import fnmatch
+import json
+import os
+
+
+EDF_PATTERNS = ['*.edf']
+MSLT_PATTERNS = ['*mslt*']
+
+
+def match_any(name, patterns, ignore_case=True):
+    if ignore_case:
+        name = name.lower()
+        patterns = [p.lower() for p in patterns]
+    return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+def scan(root, include=EDF_PATTERNS, exclude=(), recursive=True, ignore_case=True):
+    """
+    Yield the `os.DirEntry` of every file under `root` whose name matches one of the
+    `include` patterns and none of the `exclude` patterns. Entries are sorted by name
+    within a directory, and files come before subdirectories. Symbolic links to
+    directories are not followed.
+    """
+    pending = [os.fspath(root)]
+    while len(pending) > 0:
+        path = pending.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f'Cannot list {path} | {e}')
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file() and match_any(entry.name, include, ignore_case) and \
+                        not match_any(entry.name, exclude, ignore_case):
+                    yield entry
+            except OSError as e:
+                print(f'Cannot stat {entry.path} | {e}')
+
+        if recursive:
+            pending.extend(reversed(subdirs))
+
+
+def file_signature(entry):
+    stat = entry.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest:
+    """
+    Size and modification time of the files handled in previous runs, stored as JSON and
+    keyed by absolute path.
+
+        manifest = Manifest('verified.manifest.json').load()
+        for entry in manifest.changed(scan(path)):
+            ...
+            manifest.add(entry)
+        manifest.save()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.files = json.load(f)
+        return self
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.files, f)
+        os.replace(tmp_path, self.path)
+
+    def is_changed(self, entry):
+        return self.files.get(os.path.abspath(entry.path)) != file_signature(entry)
+
+    def changed(self, entries):
+        """
+        Entries that are new or changed since they were added to the manifest.
+        """
+        return (entry for entry in entries if self.is_changed(entry))
+
+    def add(self, entry):
+        self.files[os.path.abspath(entry.path)] = file_signature(entry)
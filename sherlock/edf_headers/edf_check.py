@@ -0,0 +1,76 @@
+import numpy as np
+from utils import get_file_size
+
+
+ANNOTATION_LABEL = 'EDF Annotations'
+DIGITAL_RANGE = (-32768, 32767)
+BYTES_PER_SAMPLE = 2
+
+
+def get_header_nbytes(header):
+    return 256 * (header['n_channels'] + 1)
+
+
+def get_record_nbytes(header):
+    return int(np.sum(header['n_samples_per_record'])) * BYTES_PER_SAMPLE
+
+
+def get_expected_size(header):
+    return get_header_nbytes(header) + header['n_records'] * get_record_nbytes(header)
+
+
+def check_edf_warnings(header, file_size):
+    """
+    Departures from the specification that readers (MNE, pyedflib) accept, e.g. bytes
+    after the last data record. They do not make the file non-compliant.
+    """
+    warnings = []
+    if header['n_records'] >= 0 and file_size > get_expected_size(header):
+        warnings.append(f'{file_size - get_expected_size(header)} bytes after the last data record')
+    return warnings
+
+
+def check_edf_structure(header, file_size):
+    """
+    Structural checks of a header from `read_header_edf` against the size of the file.
+    Returns a list of problems, empty when the file looks readable.
+    """
+    problems = []
+
+    n_records = header['n_records']
+    if n_records < 0:
+        problems.append(f'Unknown number of data records ({n_records})')
+    elif file_size < get_expected_size(header):
+        problems.append(f'File size {file_size} is smaller than the header says ({get_expected_size(header)} bytes)')
+
+    if header['record_length'] < 0:
+        problems.append(f'Negative record length ({header["record_length"]})')
+
+    if header['EDF+'] and ANNOTATION_LABEL not in header['channels']:
+        problems.append(f'EDF+ file without `{ANNOTATION_LABEL}` channel')
+
+    n_samples = np.asarray(header['n_samples_per_record'])
+    digital_min = header['digital_min']
+    digital_max = header['digital_max']
+    for i in np.flatnonzero(n_samples <= 0):
+        problems.append(f'{header["channels"][i]}: samples per record is {n_samples[i]}')
+    for i in np.flatnonzero(digital_max <= digital_min):
+        problems.append(f'{header["channels"][i]}: digital max <= digital min')
+    for i in np.flatnonzero((digital_min < DIGITAL_RANGE[0]) | (digital_max > DIGITAL_RANGE[1])):
+        problems.append(f'{header["channels"][i]}: digital range outside 16-bit integers')
+    for i in np.flatnonzero(header['physical_max'] == header['physical_min']):
+        problems.append(f'{header["channels"][i]}: physical max == physical min')
+
+    return problems
+
+
+def check_edf(edf_filename, header):
+    """
+    Header-only replacement for opening the file with MNE/pyedflib. Raises on problems,
+    returns the warnings.
+    """
+    file_size = get_file_size(edf_filename)
+    problems = check_edf_structure(header, file_size)
+    if len(problems) > 0:
+        raise Exception(' | '.join(problems))
+    return check_edf_warnings(header, file_size)
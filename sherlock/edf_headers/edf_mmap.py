@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+from edf_check import (
+    get_header_nbytes,
+    get_record_nbytes,
+)
+from edf_reader import read_header_edf
+
+
+class EdfMmap:
+    """
+    Lazy access to the signals of an EDF file through `np.memmap`.
+
+    Data records are mapped as a (n_records, samples per record) int16 array and each
+    channel is a strided view of its columns, so reading an epoch of one channel only
+    touches the pages holding that epoch. Digital values are scaled to physical units
+    on demand.
+
+        edf = EdfMmap('psg.edf')
+        c3 = edf.epoch('C3-M2', start_sec=30 * 100, duration_sec=30)
+    """
+
+    def __init__(self, edf_filename, header=None):
+        self.edf_filename = str(edf_filename)
+        self.header = read_header_edf(self.edf_filename) if header is None else header
+
+        h = self.header
+        header_nbytes = get_header_nbytes(h)
+        record_nbytes = get_record_nbytes(h)
+
+        file_size = os.path.getsize(self.edf_filename)
+        if file_size < header_nbytes:
+            raise Exception(f'File cut off inside the header ({file_size} of {header_nbytes} bytes)')
+        if record_nbytes <= 0:
+            raise Exception(f'Data records have no samples ({record_nbytes} bytes per record)')
+
+        # Only map complete records, whatever the header says (n_records may be -1 or wrong)
+        n_complete = max((file_size - header_nbytes) // record_nbytes, 0)
+        self.n_records = n_complete if h['n_records'] < 0 else min(h['n_records'], n_complete)
+
+        self.channels = h['channels']
+        self.record_length = h['record_length']
+        self.n_samples_per_record = np.asarray(h['n_samples_per_record'], dtype=int)
+        self.offsets = np.concatenate([[0], np.cumsum(self.n_samples_per_record)])
+        self.sample_rates = self.n_samples_per_record / self.record_length if self.record_length > 0 \
+            else np.zeros(len(self.channels))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.gain = (h['physical_max'] - h['physical_min']) / (h['digital_max'] - h['digital_min'])
+            self.physical_offset = h['physical_max'] - self.gain * h['digital_max']
+
+        if self.n_records > 0:
+            self.data = np.memmap(self.edf_filename, dtype='<i2', mode='r', offset=header_nbytes,
+                                  shape=(self.n_records, record_nbytes // 2))
+        else:
+            # An empty region cannot be mapped
+            self.data = np.zeros((0, record_nbytes // 2), dtype='<i2')
+
+    def channel_index(self, channel):
+        if isinstance(channel, str):
+            return self.channels.index(channel)
+        return channel
+
+    def records(self, channel):
+        """
+        Zero-copy (n_records, samples per record) view of the digital values of a channel.
+        """
+        i = self.channel_index(channel)
+        return self.data[:, self.offsets[i]:self.offsets[i + 1]]
+
+    def n_samples(self, channel):
+        return self.n_records * self.n_samples_per_record[self.channel_index(channel)]
+
+    def digital(self, channel, start=0, stop=None):
+        """
+        Digital values of samples [start, stop) of a channel. Only the records covering
+        the range are read.
+        """
+        i = self.channel_index(channel)
+        spr = self.n_samples_per_record[i]
+        stop = self.n_samples(i) if stop is None else min(stop, self.n_samples(i))
+        if stop <= start:
+            return np.zeros(0, dtype='<i2')
+
+        first, last = start // spr, (stop - 1) // spr + 1
+        samples = self.records(i)[first:last].reshape(-1)
+        return samples[start - first * spr:stop - first * spr]
+
+    def to_physical(self, channel, digital):
+        i = self.channel_index(channel)
+        return digital * self.gain[i] + self.physical_offset[i]
+
+    def physical(self, channel, start=0, stop=None):
+        return self.to_physical(channel, self.digital(channel, start, stop))
+
+    def epoch(self, channel, start_sec, duration_sec=30, physical=True):
+        """
+        Samples of a channel from `start_sec` to `start_sec + duration_sec`.
+        """
+        fs = self.sample_rates[self.channel_index(channel)]
+        start = int(round(start_sec * fs))
+        stop = start + int(round(duration_sec * fs))
+        if physical:
+            return self.physical(channel, start, stop)
+        return self.digital(channel, start, stop)
+
+    def close(self):
+        # The map is released once the views handed out are gone as well
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,62 +1,123 @@
-import pyedflib
-import mne
 import re, datetime
 import numpy as np
-from charset_normalizer import from_bytes as fm
+from header_cache import (
+    HEADER_ARRAY_KEYS,
+    cached,
+)
+
+
+# (header key, field width in bytes) of the signal header block, in file order.
+# Each field is stored for all channels before the next field starts.
+SIGNAL_FIELDS = [
+    ('channels', 16),
+    ('transducer_type', 80),
+    ('units', 8),
+    ('physical_min', 8),
+    ('physical_max', 8),
+    ('digital_min', 8),
+    ('digital_max', 8),
+    ('prefiltering', 80),
+    ('n_samples_per_record', 8),
+    ('reserved', 32),
+]
+
+# Format of h['date_time'], i.e. str() of the datetime
+DATE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_date_time(date_time):
+    """
+    datetime of h['date_time'] (datetime.fromisoformat needs Python 3.7).
+    """
+    return datetime.datetime.strptime(date_time, DATE_TIME_FORMAT)
 
 
 def decode_str(b):
-    return str(fm(b).best()).strip()
+    # Header fields are nearly always plain ASCII; only guess the charset when they are not
+    try:
+        return b.decode('ascii').strip()
+    except UnicodeDecodeError:
+        from charset_normalizer import from_bytes
+        return str(from_bytes(b).best()).strip()
+
+
+def split_signal_block(block, n_channels):
+    """
+    Slice the `n_channels * 256` bytes signal header block into one array per field.
+    """
+    fields = {}
+    offset = 0
+    for key, width in SIGNAL_FIELDS:
+        fields[key] = np.frombuffer(block, dtype=f'S{width}', count=n_channels, offset=offset)
+        offset += width * n_channels
+    return fields
 
 
 def read_header_edf(edf_filename):
     """
     Reference: https://github.com/akaraspt/deepsleepnet/blob/master/dhedfreader.py
+
+    The header is read with two calls: the fixed 256 bytes, then the whole signal block.
     """
     with open(edf_filename, "rb") as f:
-        
+        fixed = f.read(256)
+        if len(fixed) < 256:
+            raise Exception(f'Header cut off after {len(fixed)} bytes')
+        assert fixed[:8] == b'0       '
+
         h = {}
-        assert f.tell() == 0  # check file position
-        assert f.read(8) == b'0       '
 
-        # recording info)
-        h['local_subject_id'] = decode_str(f.read(80))
-        h['local_recording_id'] = decode_str(f.read(80))
+        # recording info
+        h['local_subject_id'] = decode_str(fixed[8:88])
+        h['local_recording_id'] = decode_str(fixed[88:168])
 
         # parse timestamp
-        (day, month, year) = [int(x) for x in re.findall('(\d+)', str(f.read(8)))]
-        (hour, minute, sec)= [int(x) for x in re.findall('(\d+)', str(f.read(8)))]
+        (day, month, year) = [int(x) for x in re.findall(rb'(\d+)', fixed[168:176])]
+        (hour, minute, sec) = [int(x) for x in re.findall(rb'(\d+)', fixed[176:184])]
         h['date_time'] = str(datetime.datetime(year + 2000, month, day,
                                                hour, minute, sec))
 
         # misc
-        header_nbytes = int(f.read(8))
-        subtype = f.read(44)[:5]
-        h['EDF+'] = 1 if subtype in ['EDF+C', 'EDF+D'] else 0
-        h['contiguous'] = subtype != 'EDF+D'
-        h['n_records'] = int(f.read(8))
-        h['record_length'] = float(f.read(8)) # in seconds
-        nchannels = h['n_channels'] = int(f.read(4))
+        header_nbytes = int(fixed[184:192])
+        subtype = fixed[192:197]
+        h['EDF+'] = 1 if subtype in [b'EDF+C', b'EDF+D'] else 0
+        h['contiguous'] = subtype != b'EDF+D'
+        h['n_records'] = int(fixed[236:244])
+        h['record_length'] = float(fixed[244:252]) # in seconds
+        nchannels = h['n_channels'] = int(fixed[252:256])
 
         # read channel info
-        channels = list(range(h['n_channels']))
-        h['channels'] = [decode_str(f.read(16)) for n in channels]
-        h['transducer_type'] = [decode_str(f.read(80)) for n in channels]
-        h['units'] = [decode_str(f.read(8)) for n in channels]
-        h['physical_min'] = np.asarray([float(f.read(8)) for n in channels])
-        h['physical_max'] = np.asarray([float(f.read(8)) for n in channels])
-        h['digital_min'] = np.asarray([float(f.read(8)) for n in channels])
-        h['digital_max'] = np.asarray([float(f.read(8)) for n in channels])
-        h['prefiltering'] = [decode_str(f.read(80)) for n in channels]
-        h['n_samples_per_record'] = [int(f.read(8)) for n in channels]
-        f.read(32 * nchannels)  # reserved
-
-        assert f.tell() == header_nbytes
-        return h
+        block = f.read(256 * nchannels)
+        if len(block) < 256 * nchannels:
+            raise Exception(f'Header cut off after {256 + len(block)} of {256 * (nchannels + 1)} bytes')
+        assert 256 + len(block) == header_nbytes
+
+    fields = split_signal_block(block, nchannels)
+    h['channels'] = [decode_str(b) for b in fields['channels']]
+    h['transducer_type'] = [decode_str(b) for b in fields['transducer_type']]
+    h['units'] = [decode_str(b) for b in fields['units']]
+    h['physical_min'] = fields['physical_min'].astype(float)
+    h['physical_max'] = fields['physical_max'].astype(float)
+    h['digital_min'] = fields['digital_min'].astype(float)
+    h['digital_max'] = fields['digital_max'].astype(float)
+    h['prefiltering'] = [decode_str(b) for b in fields['prefiltering']]
+    h['n_samples_per_record'] = [int(b) for b in fields['n_samples_per_record']]
+
+    return h
+
+
+def read_header_cached(edf_filename, cache):
+    """
+    `read_header_edf` through a HeaderCache (or None).
+    """
+    header = cached(cache, 'header', edf_filename, read_header_edf)
+    for key in HEADER_ARRAY_KEYS:
+        header[key] = np.asarray(header[key], dtype=float)
+    return header
 
 
 def read_raw_edf(edf_filename):
+    # MNE takes seconds to import: only `run.py --deep` needs it
+    import mne
     f = mne.io.read_raw_edf(edf_filename)
     return f
-
-        
\ No newline at end of file
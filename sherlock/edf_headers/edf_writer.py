@@ -0,0 +1,53 @@
+from edf_reader import SIGNAL_FIELDS, parse_date_time
+
+
+def format_field(value, width):
+    """
+    Left-aligned, space-padded ASCII field; other characters are replaced by '?'.
+    """
+    return str(value).encode('ascii', errors='replace')[:width].ljust(width)
+
+
+def format_number(value, width):
+    """
+    Shortest representation of `value` that fits in `width` characters.
+    """
+    if float(value).is_integer() and len(str(int(value))) <= width:
+        return format_field(int(value), width)
+    for precision in range(width, 0, -1):
+        s = f'{value:.{precision}g}'
+        if len(s) <= width:
+            return format_field(s, width)
+    raise ValueError(f'{value} does not fit in {width} characters')
+
+
+def format_header(h, subtype=''):
+    """
+    EDF header bytes of a dict in the format of `read_header_edf`.
+    `subtype` goes to the reserved field, e.g. 'EDF+C'.
+    """
+    start = parse_date_time(h['date_time'])
+    n_channels = h['n_channels']
+
+    fixed = b''.join([
+        format_field('0', 8),
+        format_field(h['local_subject_id'], 80),
+        format_field(h['local_recording_id'], 80),
+        format_field(start.strftime('%d.%m.%y'), 8),
+        format_field(start.strftime('%H.%M.%S'), 8),
+        format_number(256 * (n_channels + 1), 8),
+        format_field(subtype, 44),
+        format_number(h['n_records'], 8),
+        format_number(h['record_length'], 8),
+        format_number(n_channels, 4),
+    ])
+
+    signal = []
+    for key, width in SIGNAL_FIELDS:
+        values = h.get(key, [''] * n_channels)
+        if key in ['channels', 'transducer_type', 'units', 'prefiltering', 'reserved']:
+            signal.extend(format_field(v, width) for v in values)
+        else:
+            signal.extend(format_number(v, width) for v in values)
+
+    return fixed + b''.join(signal)
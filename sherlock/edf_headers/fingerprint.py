@@ -0,0 +1,96 @@
+"""
+Content fingerprints of EDF files, to find the same recording under different file stems
+(re-exports, de-identified copies) across cohorts (`run.py --fingerprint`).
+
+The fingerprint hashes what de-identification leaves alone: the channel layout (labels
+and samples per record), the record length and number of complete data records, and the
+signal bytes of FINGERPRINT_RECORDS data records at fixed fractions of the recording.
+Patient, recording and start date fields and the `EDF Annotations` signal are left out.
+Only a few pages of each file are read, whatever its size.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from edf_check import ANNOTATION_LABEL
+from edf_mmap import EdfMmap
+from shard import (
+    read_csv_rows,
+    write_csv_rows,
+)
+from const import FINGERPRINT_RECORDS
+
+
+FINGERPRINT_COL = 'fingerprint'
+DUPLICATE_COL = 'duplicate_of'
+
+
+def sampled_records(n_records, n_samples=FINGERPRINT_RECORDS):
+    """
+    Indices of the records at 1/(n+1), 2/(n+1), ... n/(n+1) of the recording.
+    """
+    return sorted({(k + 1) * n_records // (n_samples + 1) for k in range(n_samples)}) if n_records > 0 else []
+
+
+def file_fingerprint(edf_filename, header):
+    """
+    Hex digest of the de-identification invariant content of an EDF file, and the number
+    of data bytes read.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with EdfMmap(edf_filename, header) as edf:
+        signals = [i for i, label in enumerate(edf.channels) if label != ANNOTATION_LABEL]
+        layout = [f'{edf.n_records}', f'{float(edf.record_length)!r}']
+        layout += [f'{edf.channels[i]}:{edf.n_samples_per_record[i]}' for i in signals]
+        digest.update('|'.join(layout).encode('utf-8'))
+
+        nbytes = 0
+        for r in sampled_records(edf.n_records):
+            record = edf.data[r]
+            data = np.concatenate([record[edf.offsets[i]:edf.offsets[i + 1]] for i in signals]) \
+                if len(signals) > 0 else np.zeros(0, dtype='<i2')
+            digest.update(data.tobytes())
+            nbytes += record.nbytes
+
+    return digest.hexdigest(), nbytes
+
+
+def find_duplicates(rows, fingerprint_col, index_col):
+    """
+    {index: index of the first row with the same fingerprint} for every later row, in
+    one pass over the rows.
+    """
+    first = {}
+    duplicates = {}
+    for row in rows:
+        fingerprint = row[fingerprint_col]
+        if not fingerprint:
+            continue
+        original = first.setdefault(fingerprint, row[index_col])
+        if original != row[index_col]:
+            duplicates[row[index_col]] = original
+    return duplicates
+
+
+def mark_duplicates(csv_path, index_col):
+    """
+    Fill the DUPLICATE_COL column of an output CSV from its FINGERPRINT_COL column: the
+    first row of a fingerprint is the original, later rows point to it. The CSV is
+    rewritten only when it has both columns. Returns the number of duplicates, or None
+    without fingerprints.
+    """
+    if not os.path.exists(csv_path):
+        return None
+    columns, rows = read_csv_rows(csv_path)
+    if FINGERPRINT_COL not in columns:
+        return None
+
+    duplicates = find_duplicates(rows, columns.index(FINGERPRINT_COL), columns.index(index_col))
+    if DUPLICATE_COL in columns:
+        i = columns.index(index_col)
+        j = columns.index(DUPLICATE_COL)
+        for row in rows:
+            row[j] = duplicates.get(row[i], '')
+        write_csv_rows(csv_path, columns, rows)
+    return len(duplicates)
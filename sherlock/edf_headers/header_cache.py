@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from const import (
+    HEADER_CACHE_ENV,
+    HEADER_CACHE_PATH,
+    HEADER_CACHE_MAX_ENTRIES,
+)
+
+
+# Keys of the `read_header_edf` dict holding numpy arrays
+HEADER_ARRAY_KEYS = ['physical_min', 'physical_max', 'digital_min', 'digital_max']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (path, kind)
+)
+'''
+
+
+def default_cache_path():
+    """
+    $EDF_HEADER_CACHE if set, HEADER_CACHE_PATH otherwise. None (no cache) when set to ''.
+    """
+    path = os.environ.get(HEADER_CACHE_ENV, HEADER_CACHE_PATH)
+    return os.path.expanduser(path) if len(path) > 0 else None
+
+
+def json_default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f'Cannot cache value of type {type(o)}')
+
+
+def to_json(value):
+    return json.dumps(value, default=json_default)
+
+
+class HeaderCache:
+    """
+    SQLite cache of values parsed from EDF files, e.g. the `read_header_edf` dict ('header')
+    or the channel labels ('labels').
+
+    Entries are keyed by absolute path and kind, and are only returned while the size and
+    mtime of the file are unchanged. The least recently used entries are dropped by `prune()`
+    once there are more than `max_entries`. Hits only update the access time in memory; they
+    are written with the next `put()`, `prune()` or `close()`, so reads never take the
+    write lock.
+    """
+
+    def __init__(self, db_path=None, max_entries=HEADER_CACHE_MAX_ENTRIES):
+        self.db_path = default_cache_path() if db_path is None else db_path
+        self.max_entries = max_entries
+
+        db_dir = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        # autocommit: several worker processes may share the cache file. The default
+        # rollback journal is kept: WAL needs shared memory, which network filesystems
+        # (the home directory on Sherlock) do not provide across nodes.
+        self.conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        self.conn.execute(SCHEMA)
+        self._accessed = {}
+
+    @staticmethod
+    def _key(edf_filename):
+        path = os.path.abspath(str(edf_filename))
+        st = os.stat(path)
+        return path, st.st_size, st.st_mtime_ns
+
+    def get(self, edf_filename, kind):
+        path, size, mtime_ns = self._key(edf_filename)
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, value FROM cache WHERE path = ? AND kind = ?',
+            (path, kind)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+
+        self._accessed[path, kind] = time.time()
+        return json.loads(row[2])
+
+    def _write_accessed(self):
+        if len(self._accessed) == 0:
+            return
+        self.conn.executemany('UPDATE cache SET accessed = ? WHERE path = ? AND kind = ?',
+                              [(t, path, kind) for (path, kind), t in self._accessed.items()])
+        self._accessed = {}
+
+    def _commit_accessed(self):
+        if len(self._accessed) > 0:
+            with self.conn:
+                self.conn.execute('BEGIN')
+                self._write_accessed()
+
+    def put(self, edf_filename, kind, value):
+        path, size, mtime_ns = self._key(edf_filename)
+        # One transaction for the entry and the access times of the hits so far
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self._write_accessed()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cache (path, kind, size, mtime_ns, value, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (path, kind, size, mtime_ns, to_json(value), time.time()))
+
+    def invalidate(self, edf_filename=None, kind=None):
+        """
+        Drop the entries of one file (all of them when `edf_filename` is None),
+        optionally only those of `kind`.
+        """
+        query, params = 'DELETE FROM cache WHERE 1', []
+        if edf_filename is not None:
+            query += ' AND path = ?'
+            params.append(os.path.abspath(str(edf_filename)))
+        if kind is not None:
+            query += ' AND kind = ?'
+            params.append(kind)
+        self.conn.execute(query, params)
+
+    def prune(self):
+        self._commit_accessed()
+        n_entries = self.conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        n_remove = n_entries - self.max_entries
+        if n_remove > 0:
+            self.conn.execute(
+                'DELETE FROM cache WHERE rowid IN '
+                '(SELECT rowid FROM cache ORDER BY accessed LIMIT ?)', (n_remove,))
+        return max(n_remove, 0)
+
+    def close(self):
+        self._commit_accessed()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_caches = {}
+
+
+def get_cache(db_path=None):
+    """
+    One HeaderCache per process: a connection must not be shared with forked workers.
+    """
+    key = (os.getpid(), db_path)
+    if key not in _caches:
+        _caches[key] = HeaderCache(db_path)
+    return _caches[key]
+
+
+def cached(cache, kind, edf_filename, read_fn):
+    """
+    `read_fn(edf_filename)` through the cache; `cache` may be None. Empty results (e.g. no
+    labels after a failed read) are not cached, so the file is read again next time.
+    """
+    if cache is None:
+        return read_fn(edf_filename)
+
+    value = cache.get(edf_filename, kind)
+    if value is None:
+        value = read_fn(edf_filename)
+        if value:
+            cache.put(edf_filename, kind, value)
+    return value
+
@@ -1,6 +1,6 @@
 import os
-import pandas as pd
 from utils import get_file_size
+from const import FLOAT_FORMAT
 
 
 def convert_to_megabytes(size_in_bytes):
@@ -11,7 +11,7 @@ def convert_to_hours(duration_sec):
     return duration_sec / 60 / 60
 
 
-def reformat_file_info(cohort, edf_filename):
+def reformat_file_info(cohort, edf_filename, file_size=None):
     fname = edf_filename.split('/')[-1]
     fname_spl = fname.split('.')
     
@@ -19,7 +19,7 @@ def reformat_file_info(cohort, edf_filename):
         "file_stem": fname_spl[0],
         "extension": fname_spl[1],
         "cohort": cohort.split('_')[0],
-        "file_size_mb": convert_to_megabytes(get_file_size(edf_filename)),
+        "file_size_mb": convert_to_megabytes(get_file_size(edf_filename) if file_size is None else file_size),
     }
     
     return info
@@ -48,21 +48,20 @@ def index_columns_exist(index_col, header):
     return index_col in header and header[index_col] != None and len(header[index_col]) > 0
 
 
-def prepare_df(header, columns, index_col):
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '' if value != value else FLOAT_FORMAT % value
+    return value
+
+
+def prepare_record(header, columns, index_col):
+    """
+    Row of the output CSV: [index, other columns...], floats formatted with FLOAT_FORMAT.
+    """
     # get only headers specified in config
     if not index_columns_exist(index_col, header):
         raise Exception(f'index_col ({index_col}) cannot be empty')
-        
-    index = header[index_col]
-    d = {}
-    for c in columns:
-        if c in header:
-            d[c] = header[c]
-        else:
-            d[c] = ''
-    
-    header_df = pd.DataFrame(d, index=[index])
-    header_df.drop([index_col], axis=1, inplace=True)
-    
-    return header_df
 
+    return [header[index_col]] + [format_value(header.get(c, '')) for c in columns if c != index_col]
@@ -0,0 +1,129 @@
+import csv
+import os
+import shutil
+import time
+
+from reformat_header import prepare_record
+from utils import remove_if_exists
+from const import (
+    CSV_FLUSH_ROWS,
+    CSV_FLUSH_SECONDS,
+    PARTIAL_SUFFIX,
+)
+
+
+def load_index(csv_path, index_col):
+    """
+    Set of the `index_col` values of an output CSV, read row by row.
+    """
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        if index_col not in columns:
+            raise Exception(f'`{index_col}` is not a column of {csv_path}')
+        i = columns.index(index_col)
+        return {row[i] for row in reader if len(row) > i}
+
+
+def truncate_incomplete_line(fpath):
+    """
+    Drop a half-written last row, e.g. after the process was killed mid-flush.
+    """
+    with open(fpath, 'rb+') as f:
+        data = f.read()
+        if len(data) == 0 or data.endswith(b'\n'):
+            return
+        f.truncate(data.rfind(b'\n') + 1)
+
+
+def recover_partial(csv_path):
+    """
+    Promote the complete rows of an unfinished run to `csv_path`.
+    """
+    tmp_path = csv_path + PARTIAL_SUFFIX
+    if not os.path.exists(tmp_path):
+        return False
+
+    truncate_incomplete_line(tmp_path)
+    if os.path.getsize(tmp_path) == 0:
+        os.remove(tmp_path)
+        return False
+
+    os.replace(tmp_path, csv_path)
+    print(f'Recovered rows of an unfinished run: {csv_path}')
+    return True
+
+
+class ResultSink:
+    """
+    Single writer for one output CSV.
+
+    Rows are buffered as plain lists and appended to `<csv_path>.partial` every
+    `flush_rows` rows or `flush_seconds` seconds. `close()` renames the partial
+    file over `csv_path`, so readers never see a half-written CSV.
+    """
+
+    def __init__(self, csv_path, columns, index_col,
+                 flush_rows=CSV_FLUSH_ROWS, flush_seconds=CSV_FLUSH_SECONDS, keep_empty=False):
+        self.csv_path = csv_path
+        self.keep_empty = keep_empty
+        self.tmp_path = csv_path + PARTIAL_SUFFIX
+        self.columns = columns
+        self.index_col = index_col
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+
+        self._rows = []
+        self._last_flush = time.time()
+
+        if os.path.exists(csv_path):
+            shutil.copyfile(csv_path, self.tmp_path)
+        else:
+            remove_if_exists(self.tmp_path)
+
+        write_header = not os.path.exists(self.tmp_path)
+        self._file = open(self.tmp_path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if write_header:
+            self._writer.writerow([index_col] + [c for c in columns if c != index_col])
+        self._n_written = 0
+
+    def add(self, header):
+        """
+        Buffer one row. Returns True when the buffer was flushed.
+        """
+        self._rows.append(prepare_record(header, self.columns, self.index_col))
+        if len(self._rows) >= self.flush_rows or \
+                time.time() - self._last_flush >= self.flush_seconds:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        if len(self._rows) > 0:
+            self._writer.writerows(self._rows)
+            self._n_written += len(self._rows)
+            self._rows = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.time()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+        # Nothing written and no previous CSV -> don't leave a header-only file,
+        # unless asked to (shard CSVs show that the shard ran)
+        if self._n_written == 0 and not os.path.exists(self.csv_path) and not self.keep_empty:
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, self.csv_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,15 +1,42 @@
 from config_handler import Config
 from edf_reader import (
-    read_header_edf,
+    read_header_cached,
     read_raw_edf,
 )
+from edf_check import check_edf
+from header_cache import (
+    HeaderCache,
+    default_cache_path,
+    get_cache,
+)
 from reformat_header import (
-    reformat_edf_header, 
+    reformat_edf_header,
     reformat_file_info,
-    prepare_df,
 )
+from result_sink import (
+    ResultSink,
+    load_index,
+    recover_partial,
+)
+from checkpoint import Checkpoint
+from shard import (
+    find_shard_csvs,
+    in_shard,
+    merge_csvs,
+    parse_shard,
+    shard_csv_path,
+    shard_tag,
+)
+from discovery import scan
+from fingerprint import (
+    FINGERPRINT_COL,
+    DUPLICATE_COL,
+    file_fingerprint,
+    mark_duplicates,
+)
+from signal_qc import signal_qc, summarize_qc
+from timing import PipelineStats, StageTimer
 from utils import (
-    save_to_csv,
     error_if_not_exists,
     archive,
     remove,
@@ -18,125 +45,371 @@ from const import (
     EDF_COMPLIANT,
     CONFIG_PATH,
     FILE_EXT,
+    POOL_CHUNKSIZE,
 )
 
-import pandas as pd
-from pathlib import Path
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+import argparse
+import cProfile
 import os
+import time
 pjoin = os.path.join
 
 
-config = Config(CONFIG_PATH).values
-COHORTS_PATH = config["COHORTS_PATH"]
-COHORTS = config["COHORTS"]
-EDF_PATH = config["EDF_PATH"]
-HEADER_CSV_COLUMNS = config["HEADER_CSV_COLUMNS"]
-FAILED_CSV_COLUMNS = config["FAILED_CSV_COLUMNS"]
-OUTPATH = config["OUTPATH"]
-HEADER_CSV_FNAME = config["HEADER_CSV_FNAME"]
-FAILED_CSV_FNAME = config["FAILED_CSV_FNAME"]
-INDEX_COL = config["INDEX_COL"]
-ARCHIVE_PATH = config["ARCHIVE_PATH"]
-VERSION = config["VERSION"]
+def load_config(config_path=CONFIG_PATH):
+    """
+    Values of the config file, with the paths of the output CSVs. Loaded by main(), not on
+    import, so worker processes and other tools import this module without a config.
+    """
+    config = Config(config_path).values
+    config["HEADER_CSV_PATH"] = pjoin(config["OUTPATH"], config["HEADER_CSV_FNAME"])
+    config["FAILED_CSV_PATH"] = pjoin(config["OUTPATH"], config["FAILED_CSV_FNAME"])
+    return config
 
 
-HEADER_CSV_PATH = pjoin(OUTPATH, HEADER_CSV_FNAME)
-FAILED_CSV_PATH = pjoin(OUTPATH, FAILED_CSV_FNAME)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Read EDF headers of all cohorts to CSV.')
+    parser.add_argument('command', nargs='?', choices=['scan', 'merge'], default='scan',
+                        help='scan the cohorts (default) or merge the CSVs of `--shard` runs')
+    parser.add_argument('--config', default=CONFIG_PATH,
+                        help='Config file (default: %(default)s)')
+    parser.add_argument('--shard', metavar='i/N', type=parse_shard,
+                        help='Only read the files of shard i of N (0 <= i < N) and write them to separate CSVs')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes reading EDF files (default: 1)')
+    parser.add_argument('--deep', action='store_true',
+                        help='Also open every file with MNE instead of only checking the header')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help=f'Fingerprint the content of every file and fill `{DUPLICATE_COL}` with the first file '
+                             f'of the same recording (needs `{FINGERPRINT_COL}` in HEADER_CSV_COLUMNS)')
+    parser.add_argument('--qc', action='store_true',
+                        help='Also read the signals and add per-channel quality metrics (clipping, flat lines, gaps, RMS)')
+    parser.add_argument('--cache', default=default_cache_path(),
+                        help='Header cache file shared by the EDF tools (default: %(default)s)')
+    parser.add_argument('--no-cache', dest='cache', action='store_const', const=None,
+                        help='Always re-read the EDF headers')
+    parser.add_argument('--parquet', metavar='DIR',
+                        help='Also write file and channel tables with all header fields to DIR (needs pyarrow)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='Write cProfile stats of the main process to PATH (use with --workers 1)')
+    return parser.parse_args(argv)
 
 
-if __name__ == '__main__':
-    
-    existing_id = []
-    if os.path.exists(HEADER_CSV_PATH):
-        ans = input(f'{HEADER_CSV_FNAME} already exists. Please choose from the following options: \n' + \ 
-                    f'  1.) Remove old csv and re-run all\n' + \ 
-                    f'  2.) Skip existing `{INDEX_COL}` in the csv\n' + \
-                    f'Please input your option (1-2) ? : '
-                   )
-        
-        current_version = archive(OUTPATH, HEADER_CSV_FNAME, ARCHIVE_PATH, VERSION, '.csv')
-        current_version = archive(OUTPATH, FAILED_CSV_FNAME, ARCHIVE_PATH, VERSION, '.csv', current_version)
-        if ans == '1':
-            remove(HEADER_CSV_PATH)
-            remove(FAILED_CSV_PATH)
-        elif ans == '2':
-            df = pd.read_csv(HEADER_CSV_PATH)
-            existing_id = df[INDEX_COL].values
-        else:
-            raise Exception('Invalid option.')
-    
-        
-    print(f'Read EDF headers from {len(COHORTS)} cohorts: {COHORTS}')
-    for cohort in COHORTS:
+def iter_cohort_files(config, existing_id, done_cohorts=(), stats=None, shard=None):
+    """
+    Yield (cohort, edf_filename, file_info, timer) for every EDF of the cohorts of `config`
+    that is not in `existing_id` (and is in `shard`), followed by (cohort, None, None, None)
+    once all files of a cohort are queued.
+    """
+    index_col = config["INDEX_COL"]
+    for cohort in config["COHORTS"]:
         print('\n\n' + '='*30, cohort, '='*30)
-        edf_path_str = EDF_PATH.replace('<COHORT_PATH>', COHORTS_PATH).replace('<COHORT>', cohort)
+        if cohort in done_cohorts:
+            print(f'{cohort} finished in the previous run -> SKIP.')
+            continue
+
+        edf_path_str = config["EDF_PATH"].replace('<COHORT_PATH>', config["COHORTS_PATH"]) \
+                                         .replace('<COHORT>', cohort)
         error_if_not_exists(edf_path_str)
-        
-        edf_path = Path(edf_path_str)
-        cohort_files = edf_path.glob(FILE_EXT)
-
-        
-        for edf_filename in cohort_files:
-            edf_filename = str(edf_filename)
-            edf_compliant = EDF_COMPLIANT.SUCCESS
+
+        start = time.perf_counter()
+        cohort_files = list(scan(edf_path_str, include=[FILE_EXT], recursive=False))
+        if stats is not None:
+            stats.add_stage(cohort, 'scan', time.perf_counter() - start)
+
+        for entry in cohort_files:
+            edf_filename = entry.path
+            if shard is not None and not in_shard(cohort, edf_filename, shard):
+                continue
             all_header = {}
-            error_msg = None
+            timer = StageTimer()
 
-            
             try:
-                all_header.update(**reformat_file_info(cohort, edf_filename))
+                with timer.stage('file_info'):
+                    all_header.update(**reformat_file_info(cohort, edf_filename, entry.stat().st_size))
             except Exception as e:
                 print(f'Cannot read file-info header from {edf_filename} | {e}')
-                error_msg = e
 
-                
-            index = all_header[INDEX_COL]   
+            index = all_header[index_col]
             if index in existing_id:
                 print(f'{index} already exists -> SKIP.')
                 continue
             else:
-                existing_id.append(index)
-                
-            try:
-                header = read_header_edf(edf_filename)
-                all_header.update(**reformat_edf_header(header))
-            except Exception as e:
-                print(f'Cannot read edf-info header from {edf_filename} | {e}')
-                error_msg = e
+                existing_id.add(index)
 
-                
-            try:
+            yield cohort, edf_filename, all_header, timer
+
+        yield cohort, None, None, None
+
+
+def read_edf_info(task, deep=False, fingerprint=False, qc=False, cache_path=None, keep_header=False):
+    """
+    Read the EDF header and check the file is structurally valid (and opens with MNE if `deep`).
+    With `fingerprint`, a few data records of a valid file are hashed (fingerprint.py); with
+    `qc`, its signals are read for the quality metrics of signal_qc.py.
+    Runs in a worker process when `--workers` > 1, so the error is returned as a string.
+    The parsed header and the per-channel metrics are only sent back with `keep_header`
+    (for the Parquet tables).
+    """
+    cohort, edf_filename, all_header, timer = task
+    if edf_filename is None:
+        return cohort, None, None, None, None, None, None
+
+    edf_compliant = EDF_COMPLIANT.SUCCESS
+    error_msg = None
+    header = None
+    cache = get_cache(cache_path) if cache_path else None
+
+    try:
+        with timer.stage('read_header'):
+            header = read_header_cached(edf_filename, cache)
+        timer.nbytes += 256 * (header['n_channels'] + 1)
+        all_header.update(**reformat_edf_header(header))
+    except Exception as e:
+        print(f'Cannot read edf-info header from {edf_filename} | {e}')
+        error_msg = e
+
+    if header is not None:
+        try:
+            with timer.stage('check'):
+                warnings = check_edf(edf_filename, header)
+            for warning in warnings:
+                print(f'Warning | {edf_filename} | {warning}')
+        except Exception as e:
+            print(f'Invalid EDF structure | {e}')
+            error_msg = e
+
+    if fingerprint and header is not None and not error_msg:
+        try:
+            with timer.stage('fingerprint'):
+                all_header[FINGERPRINT_COL], nbytes = file_fingerprint(edf_filename, header)
+            timer.nbytes += nbytes
+        except Exception as e:
+            print(f'Cannot compute fingerprint | {e}')
+
+    channel_qc = None
+    if qc and header is not None and not error_msg:
+        # A QC failure is reported, but does not make the file non-compliant
+        try:
+            with timer.stage('qc'):
+                channel_qc, nbytes = signal_qc(edf_filename, header)
+            timer.nbytes += nbytes
+            all_header.update(**summarize_qc(header, channel_qc))
+        except Exception as e:
+            print(f'Cannot compute signal QC | {e}')
+
+    if deep:
+        try:
+            with timer.stage('read_raw'):
                 raw_reader = read_raw_edf(edf_filename)
-            except Exception as e:
-                print(f'Cannot read raw EDF | {e}')
-                raw_reader = None
-                error_msg = e
-
-
-            if error_msg:
-                edf_compliant = EDF_COMPLIANT.ERROR
-                
-                
-            additional_info = {
-                "edf_compliant": edf_compliant
-            }
-            all_header.update(**additional_info)
-
-
-            headers_df = prepare_df(all_header, HEADER_CSV_COLUMNS, INDEX_COL)
-            save_to_csv(headers_df, HEADER_CSV_PATH, HEADER_CSV_COLUMNS, INDEX_COL)
-            del headers_df
-            
-            
-            if edf_compliant == EDF_COMPLIANT.SUCCESS:
-                print(f'{index} | EDF header saved: {HEADER_CSV_FNAME}\n')
-                
-            else:
-                print(f'{index} | EDF header saved with exception:' +\
-                      f' {HEADER_CSV_FNAME} & {FAILED_CSV_FNAME}\n')
-                all_header["error"] = error_msg
-                failed_df = prepare_df(all_header, FAILED_CSV_COLUMNS, INDEX_COL)
-                save_to_csv(failed_df, FAILED_CSV_PATH, FAILED_CSV_COLUMNS, INDEX_COL)
-                del failed_df
+        except Exception as e:
+            print(f'Cannot read raw EDF | {e}')
+            raw_reader = None
+            error_msg = e
+
+    if error_msg:
+        edf_compliant = EDF_COMPLIANT.ERROR
+        error_msg = str(error_msg)
+
+    additional_info = {
+        "edf_compliant": edf_compliant
+    }
+    all_header.update(**additional_info)
+
+    if not keep_header:
+        header, channel_qc = None, None
+    return cohort, edf_filename, all_header, header, channel_qc, error_msg, timer
+
+
+def save_edf_info(all_header, error_msg, header_sink, failed_sink):
+    """
+    Returns True when the rows were flushed to disk.
+    """
+    index = all_header[header_sink.index_col]
+    flushed = header_sink.add(all_header)
+    header_csv_fname = os.path.basename(header_sink.csv_path)
+
+    if all_header["edf_compliant"] == EDF_COMPLIANT.SUCCESS:
+        print(f'{index} | EDF header saved: {header_csv_fname}\n')
+
+    else:
+        print(f'{index} | EDF header saved with exception:' +\
+              f' {header_csv_fname} & {os.path.basename(failed_sink.csv_path)}\n')
+        all_header["error"] = error_msg
+        failed_sink.add(all_header)
+
+    if flushed:
+        failed_sink.flush()
+    return flushed
+
 
+def save_results(results, header_sink, failed_sink, checkpoint, stats, columnar=None):
+    for cohort, edf_filename, all_header, header, channel_qc, error_msg, timer in results:
+        if edf_filename is None:
+            header_sink.flush()
+            failed_sink.flush()
+            if columnar is not None:
+                columnar.flush()
+            checkpoint.cohort_done(cohort)
+            stats.cohort_done(cohort)
+            continue
+
+        checkpoint.last_file = edf_filename
+        with timer.stage('save'):
+            if columnar is not None:
+                columnar.add(edf_filename, all_header, header, channel_qc, error_msg)
+            flushed = save_edf_info(all_header, error_msg, header_sink, failed_sink)
+            if flushed and columnar is not None:
+                columnar.flush()
+        if flushed:
+            checkpoint.save()
+        stats.add(cohort, edf_filename, timer, all_header.get('file_size_mb', 0) * 2 ** 20)
+
+
+def print_duplicates(n_duplicates):
+    if n_duplicates is not None:
+        print(f'{n_duplicates} files have the same `{FINGERPRINT_COL}` as an earlier file (`{DUPLICATE_COL}`)')
+
+
+def archive_csvs(config):
+    outpath, archive_path, version = config["OUTPATH"], config["ARCHIVE_PATH"], config["VERSION"]
+    current_version = archive(outpath, config["HEADER_CSV_FNAME"], archive_path, version, '.csv')
+    archive(outpath, config["FAILED_CSV_FNAME"], archive_path, version, '.csv', current_version)
+
+
+def merge_shards(config):
+    """
+    Combine the CSVs of all `--shard` runs into HEADER_CSV_PATH and FAILED_CSV_PATH,
+    de-duplicated on INDEX_COL. The previous CSVs are archived first.
+    """
+    index_col = config["INDEX_COL"]
+    shard_csvs = []
+    for csv_path in [config["HEADER_CSV_PATH"], config["FAILED_CSV_PATH"]]:
+        shard_paths, count = find_shard_csvs(csv_path)
+        print(f'{os.path.basename(csv_path)}: rows from {len(shard_paths)} of {count} shards')
+        shard_csvs.append((csv_path, shard_paths))
+
+    archive_csvs(config)
+
+    for csv_path, shard_paths in shard_csvs:
+        n_rows, n_duplicates = merge_csvs(csv_path, shard_paths, index_col)
+        print(f'Merged {csv_path}: {n_rows} rows, {n_duplicates} duplicate `{index_col}` replaced')
+
+    # Shards only see their own files: duplicates across shards are found in the merged CSV
+    print_duplicates(mark_duplicates(config["HEADER_CSV_PATH"], index_col))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+    if args.command == 'merge':
+        merge_shards(config)
+        return
+
+    index_col = config["INDEX_COL"]
+    cohorts = config["COHORTS"]
+    if args.fingerprint and FINGERPRINT_COL not in config["HEADER_CSV_COLUMNS"]:
+        raise Exception(f'Add `{FINGERPRINT_COL}` (and `{DUPLICATE_COL}`) to HEADER_CSV_COLUMNS to use --fingerprint')
+
+    if args.parquet:
+        # pyarrow is only needed for the Parquet output
+        from columnar import ColumnarOutput, remove_tables
+
+    header_csv_path = config["HEADER_CSV_PATH"]
+    failed_csv_path = config["FAILED_CSV_PATH"]
+    parquet_tag = ''
+    if args.shard is not None:
+        # Each shard writes its own CSVs (and checkpoint); `run.py merge` combines them
+        header_csv_path = shard_csv_path(header_csv_path, args.shard)
+        failed_csv_path = shard_csv_path(failed_csv_path, args.shard)
+        parquet_tag = shard_tag(args.shard)
+        print(f'Shard {args.shard[0]} of {args.shard[1]} -> {header_csv_path}')
+
+    recover_partial(header_csv_path)
+    recover_partial(failed_csv_path)
+
+    existing_id = set()
+    checkpoint = Checkpoint(header_csv_path)
+    if args.shard is not None and os.path.exists(header_csv_path):
+        # Job arrays cannot answer the prompt: a shard restarted by the scheduler resumes
+        print(f'{header_csv_path} already exists -> skip existing `{index_col}`.')
+        existing_id = load_index(header_csv_path, index_col)
+        checkpoint.load()
+    elif os.path.exists(header_csv_path):
+        ans = input(f'{config["HEADER_CSV_FNAME"]} already exists. Please choose from the following options: \n' + \
+                    f'  1.) Remove old csv and re-run all\n' + \
+                    f'  2.) Skip existing `{index_col}` in the csv\n' + \
+                    f'Please input your option (1-2) ? : '
+                   )
+
+        archive_csvs(config)
+        if ans == '1':
+            remove(header_csv_path)
+            remove(failed_csv_path)
+            checkpoint.remove()
+            if args.parquet:
+                remove_tables(args.parquet, parquet_tag)
+        elif ans == '2':
+            existing_id = load_index(header_csv_path, index_col)
+            checkpoint.load()
+        else:
+            raise Exception('Invalid option.')
+    else:
+        checkpoint.remove()
+        if args.parquet:
+            remove_tables(args.parquet, parquet_tag)
+
+
+    print(f'Read EDF headers from {len(cohorts)} cohorts: {cohorts}')
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    stats = PipelineStats()
+    tasks = iter_cohort_files(config, existing_id, list(checkpoint.done_cohorts), stats, args.shard)
+    read_edf = partial(read_edf_info, deep=args.deep, fingerprint=args.fingerprint, qc=args.qc,
+                       cache_path=args.cache, keep_header=bool(args.parquet))
+
+    if args.shard is not None:
+        # Marks the shard as unfinished for `run.py merge` until it ends
+        checkpoint.save()
+
+    # The Parquet tables are flushed with the CSVs, also when the run fails.
+    # Shards always write both CSVs, so `run.py merge` can tell that every shard ran.
+    keep_empty = args.shard is not None
+    with ResultSink(header_csv_path, config["HEADER_CSV_COLUMNS"], index_col, keep_empty=keep_empty) as header_sink, \
+         ResultSink(failed_csv_path, config["FAILED_CSV_COLUMNS"], index_col, keep_empty=keep_empty) as failed_sink, \
+         ExitStack() as stack:
+        columnar = stack.enter_context(ColumnarOutput(args.parquet, parquet_tag)) if args.parquet else None
+
+        if args.workers > 1:
+            # Files are read by the pool, results come back in scan order and
+            # only this process writes to the CSVs.
+            print(f'Reading EDF files with {args.workers} worker processes')
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                results = executor.map(read_edf, tasks, chunksize=POOL_CHUNKSIZE)
+                save_results(results, header_sink, failed_sink, checkpoint, stats, columnar)
+        else:
+            save_results(map(read_edf, tasks), header_sink, failed_sink, checkpoint, stats, columnar)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f'Profile written to {args.profile} (python -m pstats {args.profile})')
+    print(stats.summary())
+
+    if args.fingerprint and args.shard is None:
+        print_duplicates(mark_duplicates(header_csv_path, index_col))
+
+    # Finished: the next "skip existing" run has to look at every cohort again
+    checkpoint.remove()
+
+    if args.cache:
+        with HeaderCache(args.cache) as cache:
+            cache.prune()
+
+
+if __name__ == '__main__':
+    main()
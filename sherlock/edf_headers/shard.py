@@ -0,0 +1,145 @@
+"""
+Split the header scan over independent processes (e.g. a SLURM job array) with
+`run.py --shard i/N`, then combine their CSVs with `run.py merge`.
+
+A file belongs to shard `md5(<cohort>/<file name>) mod N`, so every shard sees the same
+split whichever node it runs on and however the cohorts are mounted.
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import re
+
+from const import (
+    CHECKPOINT_SUFFIX,
+    PARTIAL_SUFFIX,
+)
+
+
+SHARD_PATTERN = re.compile(r'\.shard-(\d+)-of-(\d+)\.csv$')
+
+
+def parse_shard(shard):
+    """
+    'i/N' -> (i, N), with 0 <= i < N (e.g. `--shard $SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT`).
+    Used as an argparse `type`, so errors are reported as usage errors.
+    """
+    try:
+        index, count = [int(x) for x in shard.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid shard `{shard}`, expected i/N')
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'invalid shard `{shard}`, expected 0 <= i < N')
+    return index, count
+
+
+def shard_of(cohort, edf_filename, count):
+    key = f'{cohort}/{os.path.basename(edf_filename)}'.encode('utf-8')
+    return int.from_bytes(hashlib.md5(key).digest()[:8], 'little') % count
+
+
+def in_shard(cohort, edf_filename, shard):
+    index, count = shard
+    return shard_of(cohort, edf_filename, count) == index
+
+
+def shard_tag(shard):
+    index, count = shard
+    return f'shard-{index:03d}-of-{count:03d}'
+
+
+def shard_csv_path(csv_path, shard):
+    """
+    oak_psg_dictionary.csv -> oak_psg_dictionary.shard-003-of-016.csv
+    """
+    stem, ext = os.path.splitext(csv_path)
+    return f'{stem}.{shard_tag(shard)}{ext}'
+
+
+def find_shard_csvs(csv_path):
+    """
+    Output CSVs of all shards of `csv_path`, in shard order, and the number of shards N.
+    Raises unless there is exactly one finished CSV (no partial file or checkpoint left)
+    for each shard 0 .. N-1.
+    """
+    stem, ext = os.path.splitext(csv_path)
+    shard_paths = {}
+    for path in glob.glob(glob.escape(stem) + '.shard-*-of-*' + ext):
+        match = SHARD_PATTERN.search(path)
+        if match is not None:
+            shard_paths[int(match.group(1)), int(match.group(2))] = path
+
+    counts = {count for _, count in shard_paths}
+    if len(counts) == 0:
+        raise Exception(f'No shard CSVs next to {csv_path}')
+    if len(counts) > 1:
+        raise Exception(f'Shards of different runs (N = {sorted(counts)}) next to {csv_path}')
+    count = counts.pop()
+
+    # Shards write their CSVs even without rows, so a missing file is a shard that never ran
+    missing = sorted(set(range(count)) - {index for index, _ in shard_paths})
+    if len(missing) > 0:
+        raise Exception(f'Missing shards of {csv_path}: ' +
+                        ', '.join(shard_tag((index, count)) for index in missing))
+
+    unfinished = []
+    for path in shard_paths.values():
+        if os.path.exists(path + PARTIAL_SUFFIX) or os.path.exists(path + CHECKPOINT_SUFFIX):
+            unfinished.append(path)
+    if len(unfinished) > 0:
+        raise Exception(f'Unfinished shards: {unfinished}')
+
+    return [shard_paths[key] for key in sorted(shard_paths)], count
+
+
+def read_csv_rows(csv_path):
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        return columns, list(reader)
+
+
+def write_csv_rows(csv_path, columns, rows):
+    """
+    Replace `csv_path` with `columns` and `rows`, through a partial file.
+    """
+    tmp_path = csv_path + PARTIAL_SUFFIX
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, csv_path)
+
+
+def merge_csvs(csv_path, shard_paths, index_col):
+    """
+    Rows of `csv_path` (if it exists) and of the shard CSVs, de-duplicated on `index_col`:
+    a later row replaces an earlier one with the same index, in its original position.
+    The result replaces `csv_path`. Returns (number of rows, number of duplicates).
+    """
+    sources = ([csv_path] if os.path.exists(csv_path) else []) + list(shard_paths)
+    columns = None
+    rows = {}
+    n_duplicates = 0
+    for path in sources:
+        source_columns, source_rows = read_csv_rows(path)
+        if columns is None:
+            columns = source_columns
+        elif source_columns != columns:
+            raise Exception(f'Columns of {path} differ from {sources[0]}')
+
+        i = columns.index(index_col)
+        for row in source_rows:
+            if row[i] in rows:
+                n_duplicates += 1
+            rows[row[i]] = row
+
+    if columns is None:
+        return 0, 0
+
+    write_csv_rows(csv_path, columns, rows.values())
+    return len(rows), n_duplicates
@@ -0,0 +1,157 @@
+"""
+Signal quality metrics of every channel of an EDF file (`run.py --qc`).
+
+Data records are read a block of about QC_BLOCK_BYTES at a time, so memory use does not
+depend on the recording length. Per channel:
+
+  clipped_min_fraction   fraction of samples at the digital minimum
+  clipped_max_fraction   fraction of samples at the digital maximum
+  flat_fraction          fraction of samples in runs of one value lasting QC_FLAT_SECONDS or more
+  max_flat_seconds       longest run of one value
+  gap_fraction           fraction of data records holding one value for the whole record
+                         (EDF has no NaN: recorders fill missing data with a constant)
+  rms                    root mean square, in physical units
+"""
+import numpy as np
+
+from edf_check import (
+    ANNOTATION_LABEL,
+    get_record_nbytes,
+)
+from edf_mmap import EdfMmap
+from const import (
+    QC_BLOCK_BYTES,
+    QC_CLIPPED_FRACTION,
+    QC_FLAT_FRACTION,
+    QC_FLAT_SECONDS,
+    QC_GAP_FRACTION,
+)
+
+
+QC_METRICS = ['clipped_min_fraction', 'clipped_max_fraction', 'flat_fraction', 'max_flat_seconds',
+              'gap_fraction', 'rms']
+
+
+class ChannelQC:
+    """
+    Running counts of one channel, updated with blocks of (records, samples per record)
+    digital values. Runs of one value are carried over from one block to the next.
+    """
+
+    def __init__(self, digital_min, digital_max, gain, offset, sample_rate):
+        self.digital_min = digital_min
+        self.digital_max = digital_max
+        self.gain = gain
+        self.offset = offset
+        self.sample_rate = sample_rate
+        self.min_flat = max(2, int(round(QC_FLAT_SECONDS * sample_rate)))
+
+        self.n_samples = 0
+        self.n_records = 0
+        self.n_min = 0
+        self.n_max = 0
+        self.n_gap_records = 0
+        self.n_flat = 0
+        self.max_flat = 0
+        self.sum = 0
+        self.sum_sq = 0
+        self.run_value = None
+        self.run_length = 0
+
+    def add(self, records):
+        values = records.reshape(-1)
+        if len(values) == 0:
+            return
+
+        self.n_samples += len(values)
+        self.n_records += records.shape[0]
+        self.n_min += np.count_nonzero(values == self.digital_min)
+        self.n_max += np.count_nonzero(values == self.digital_max)
+        if records.shape[1] > 1:
+            self.n_gap_records += np.count_nonzero((records == records[:, :1]).all(axis=1))
+
+        values64 = values.astype(np.int64)
+        self.sum += int(values64.sum())
+        self.sum_sq += int(np.dot(values64, values64))
+        self.add_runs(values)
+
+    def end_run(self, length):
+        if length >= self.min_flat:
+            self.n_flat += length
+        self.max_flat = max(self.max_flat, length)
+
+    def add_runs(self, values):
+        starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+        lengths = np.diff(np.concatenate([[0], starts, [len(values)]]))
+        if self.run_length > 0 and values[0] == self.run_value:
+            lengths[0] += self.run_length
+        else:
+            self.end_run(self.run_length)
+
+        # The last run may go on in the next block
+        complete = lengths[:-1]
+        self.n_flat += int(complete[complete >= self.min_flat].sum())
+        self.max_flat = max(self.max_flat, int(complete.max(initial=0)))
+        self.run_value = values[-1]
+        self.run_length = int(lengths[-1])
+
+    def result(self):
+        self.end_run(self.run_length)
+        self.run_length = 0
+        if self.n_samples == 0:
+            return dict.fromkeys(QC_METRICS)
+
+        mean = self.sum / self.n_samples
+        mean_sq = self.sum_sq / self.n_samples
+        # mean of (gain * d + offset) ** 2 from the moments of the digital values
+        physical_sq = self.gain ** 2 * mean_sq + 2 * self.gain * self.offset * mean + self.offset ** 2
+        return {
+            'clipped_min_fraction': int(self.n_min) / self.n_samples,
+            'clipped_max_fraction': int(self.n_max) / self.n_samples,
+            'flat_fraction': self.n_flat / self.n_samples,
+            'max_flat_seconds': self.max_flat / float(self.sample_rate) if self.sample_rate > 0 else None,
+            'gap_fraction': int(self.n_gap_records) / self.n_records,
+            'rms': float(np.sqrt(max(physical_sq, 0.0))),
+        }
+
+
+def signal_qc(edf_filename, header, block_bytes=QC_BLOCK_BYTES):
+    """
+    {channel index: metrics} for every signal of the file (not `EDF Annotations`), and
+    the number of bytes of data records read.
+    """
+    with EdfMmap(edf_filename, header) as edf:
+        channels = {}
+        for i, label in enumerate(edf.channels):
+            if label == ANNOTATION_LABEL:
+                continue
+            channels[i] = ChannelQC(header['digital_min'][i], header['digital_max'][i],
+                                    edf.gain[i], edf.physical_offset[i], edf.sample_rates[i])
+
+        record_nbytes = get_record_nbytes(header)
+        block_records = max(1, block_bytes // max(record_nbytes, 1))
+        for first in range(0, edf.n_records, block_records):
+            # One sequential read per block, then a view per channel
+            block = np.array(edf.data[first:first + block_records])
+            for i, qc in channels.items():
+                qc.add(block[:, edf.offsets[i]:edf.offsets[i + 1]])
+
+        return {i: qc.result() for i, qc in channels.items()}, edf.n_records * record_nbytes
+
+
+def channels_where(header, channel_qc, is_bad):
+    return ';'.join(header['channels'][i] for i, qc in channel_qc.items()
+                    if qc['rms'] is not None and is_bad(qc))
+
+
+def summarize_qc(header, channel_qc):
+    """
+    File-level columns of the PSG dictionary: labels of the channels over the
+    QC_*_FRACTION thresholds, separated by ';'.
+    """
+    return {
+        'qc_clipped_channels': channels_where(header, channel_qc, lambda qc: qc['clipped_min_fraction'] +
+                                              qc['clipped_max_fraction'] >= QC_CLIPPED_FRACTION),
+        'qc_flat_channels': channels_where(header, channel_qc, lambda qc: qc['flat_fraction'] >= QC_FLAT_FRACTION),
+        'qc_gap_channels': channels_where(header, channel_qc, lambda qc: qc['gap_fraction'] >= QC_GAP_FRACTION),
+    }
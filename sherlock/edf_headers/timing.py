@@ -0,0 +1,107 @@
+import heapq
+import time
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Stages of run.py, in pipeline order
+STAGES = ['scan', 'file_info', 'read_header', 'check', 'fingerprint', 'qc', 'read_raw', 'save']
+PERCENTILES = [50, 90, 99]
+SLOWEST_FILES = 10
+
+
+class StageTimer:
+    """
+    Seconds spent in each stage for one file. Travels with the file from the main
+    process to the worker and back, so it has to stay picklable.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.nbytes = 0
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self):
+        return sum(self.seconds.values())
+
+
+class PipelineStats:
+    """
+    Stage durations of all files, per cohort. Only the durations are kept (8 bytes per
+    file and stage), plus the SLOWEST_FILES slowest files.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = {}        # (cohort, stage) -> array of seconds
+        self.files = {}          # cohort -> number of files
+        self.nbytes = {}         # cohort -> bytes read (headers, and signals with --qc)
+        self.file_nbytes = {}    # cohort -> size of the files
+        self.wall = {}           # cohort -> seconds from the previous cohort
+        self.slowest = []        # heap of (seconds, file)
+        self.last_done = self.start
+
+    def add_stage(self, cohort, stage, seconds):
+        self.seconds.setdefault((cohort, stage), array('d')).append(seconds)
+
+    def add(self, cohort, edf_filename, timer, file_nbytes=0):
+        for stage, seconds in timer.seconds.items():
+            self.add_stage(cohort, stage, seconds)
+        self.files[cohort] = self.files.get(cohort, 0) + 1
+        self.nbytes[cohort] = self.nbytes.get(cohort, 0) + timer.nbytes
+        self.file_nbytes[cohort] = self.file_nbytes.get(cohort, 0) + file_nbytes
+
+        item = (timer.total(), edf_filename)
+        if len(self.slowest) < SLOWEST_FILES:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def cohort_done(self, cohort):
+        now = time.perf_counter()
+        self.wall[cohort] = now - self.last_done
+        self.last_done = now
+
+    def stage_seconds(self, stage, cohort=None):
+        values = [v for (c, s), v in self.seconds.items() if s == stage and (cohort is None or c == cohort)]
+        return np.concatenate([np.frombuffer(v) for v in values]) if len(values) > 0 else np.zeros(0)
+
+    def format_stages(self, cohort=None, indent='  '):
+        lines = [indent + f'{"stage":<12}{"n":>8}{"total s":>10}{"mean ms":>10}' +
+                 ''.join(f'{f"p{p} ms":>10}' for p in PERCENTILES) + f'{"max ms":>10}']
+        for stage in STAGES:
+            seconds = self.stage_seconds(stage, cohort)
+            if len(seconds) == 0:
+                continue
+            ms = 1e3 * seconds
+            lines.append(indent + f'{stage:<12}{len(seconds):>8}{seconds.sum():>10.2f}{ms.mean():>10.2f}' +
+                         ''.join(f'{v:>10.2f}' for v in np.percentile(ms, PERCENTILES)) + f'{ms.max():>10.2f}')
+        return lines
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        n_files = sum(self.files.values())
+        mb = sum(self.nbytes.values()) / 2 ** 20
+        lines = ['', '=' * 30 + ' Timing ' + '=' * 30,
+                 f'{n_files} files in {elapsed:.1f} s ({n_files / elapsed:.1f} files/s), '
+                 f'{mb:.1f} MB read, {sum(self.file_nbytes.values()) / 2 ** 30:.2f} GB of EDF files']
+        lines += self.format_stages()
+
+        for cohort in self.files:
+            wall = max(self.wall.get(cohort, 0.0), 1e-9)
+            lines += ['', f'{cohort}: {self.files[cohort]} files in {wall:.1f} s '
+                          f'({self.files[cohort] / wall:.1f} files/s), {self.nbytes[cohort] / 2 ** 20:.1f} MB read']
+            lines += self.format_stages(cohort)
+
+        lines += ['', f'Slowest {len(self.slowest)} files (all stages):']
+        lines += [f'  {seconds * 1e3:10.1f} ms  {edf_filename}' for seconds, edf_filename in sorted(self.slowest, reverse=True)]
+        return '\n'.join(lines)
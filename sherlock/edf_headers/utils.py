@@ -36,20 +36,6 @@ def get_file_size(filename):
     return os.path.getsize(filename)
 
 
-def save_to_csv(df, csv_path, columns, index_col):
-    if os.path.exists(csv_path):
-        mode = "a"
-        header = False
-    else:
-        mode = "w"
-        header = True
-        
-    columns = [c for c in columns if c != index_col]
-    df.to_csv(csv_path, mode = mode, columns=columns, 
-              header=header, index_label=index_col,
-              float_format='%.3f')
-        
-    
 def add_file_extension(filename, extension):
     extension = extension.replace('.', '')
     if not extension.lower() in filename.lower():
@@ -88,6 +74,11 @@ def archive(fpath, fname, arch_path, version, ftype = '.csv', current_version=No
     return current_version
     
 
+def remove_if_exists(fpath):
+    if os.path.exists(fpath):
+        os.remove(fpath)
+
+
 def remove(fpath):
     if not os.path.exists(fpath):
         print(f'No file to remove | {fpath} doesn\'t exist.')